@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+"""
+Module to read the properties of the recorded audio
+clips directly from their container headers, so that
+the speaker counting scripts do not need to decode a
+clip only to learn its length
+
+It also decodes the clips, and can keep the decoded
+signals in a PCM cache folder, memory-mapped by later
+runs over the same clips instead of decoding them again
+"""
+
+import os
+import glob
+import mmap
+import hashlib
+import struct
+import numpy as np
+import soundfile
+import audioread
+from collections import namedtuple
+
+# WAV format tags whose header frame count describes the decoded samples exactly
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+WavHeader = namedtuple('WavHeader', ['format_tag', 'channels', 'sample_rate', 'block_align', 'bits_per_sample',
+                                     'data_offset', 'frames'])
+
+# MPEG audio frame header tables, indexed by (MPEG version 1 or 2, layer)
+MPEG_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MPEG_SAMPLE_RATES = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    2.5: (11025, 12000, 8000),
+}
+
+# Sample types of the WAV formats that can be memory-mapped, indexed by (format tag, bits per sample)
+WAV_SAMPLE_DTYPES = {
+    (WAVE_FORMAT_PCM, 8): np.dtype('u1'),
+    (WAVE_FORMAT_PCM, 16): np.dtype('<i2'),
+    (WAVE_FORMAT_PCM, 32): np.dtype('<i4'),
+    (WAVE_FORMAT_IEEE_FLOAT, 32): np.dtype('<f4'),
+    (WAVE_FORMAT_IEEE_FLOAT, 64): np.dtype('<f8'),
+}
+
+MP3Frame = namedtuple('MP3Frame', ['version', 'layer', 'sample_rate', 'mono', 'frame_bytes', 'samples'])
+
+# Maximum number of bytes searched for the first MPEG frame after the ID3v2 tag
+MP3_SYNC_SEARCH_BYTES = 64 * 1024
+
+# Suffix of the decoded clips kept in a PCM cache folder, as "<key>_<sampling rate>.pcm.npy"
+PCM_CACHE_SUFFIX = '.pcm.npy'
+
+
+# Function to read the format and the sample count of a WAV file from its RIFF header
+# Returns None if the file is not a RIFF/WAVE file or its header cannot be parsed
+def read_wav_header(path):
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        riff = f.read(12)
+        if len(riff) < 12 or riff[0:4] != b'RIFF' or riff[8:12] != b'WAVE':
+            return None
+
+        fmt = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                return None
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+
+            if chunk_id == b'fmt ':
+                body = f.read(chunk_size)
+                if len(body) < 16:
+                    return None
+                format_tag, channels, rate, byte_rate, block_align, bits = struct.unpack('<HHIIHH', body[:16])
+                if format_tag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                    # the actual format is the first two bytes of the sub-format GUID
+                    format_tag = struct.unpack('<H', body[24:26])[0]
+                fmt = (format_tag, channels, rate, block_align, bits)
+                f.seek(chunk_size & 1, 1)
+            elif chunk_id == b'data':
+                if fmt is None or fmt[3] == 0:
+                    return None
+                data_offset = f.tell()
+                # Streaming recorders may leave the data size as 0 or 0xFFFFFFFF, and truncated
+                # uploads may end before it, so never count beyond the end of the file
+                available = file_size - data_offset
+                if chunk_size == 0 or chunk_size > available:
+                    chunk_size = available
+                return WavHeader(fmt[0], fmt[1], fmt[2], fmt[3], fmt[4], data_offset, chunk_size // fmt[3])
+            else:
+                f.seek(chunk_size + (chunk_size & 1), 1)
+
+
+# Function to find the duration (in seconds) of a WAV clip from its header
+# Returns None for compressed WAV formats, whose frame count cannot be derived from the data size
+def wav_duration(path):
+    header = read_wav_header(path)
+    if header is None or header.sample_rate == 0:
+        return None
+    if header.format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT):
+        return None
+    if header.block_align != header.channels * ((header.bits_per_sample + 7) // 8):
+        return None
+    return header.frames / header.sample_rate
+
+
+# Function to find the header and sample type of a PCM or floating point WAV clip that can be memory-mapped
+# Returns None if the format cannot be mapped (e.g. 24-bit or compressed WAV)
+def mappable_wav(path):
+    try:
+        header = read_wav_header(path)
+    except (OSError, struct.error):
+        return None
+    if header is None or header.frames == 0 or header.sample_rate == 0:
+        return None
+    dtype = WAV_SAMPLE_DTYPES.get((header.format_tag, header.bits_per_sample))
+    if dtype is None or header.block_align != header.channels * dtype.itemsize:
+        return None
+    return header, dtype
+
+
+# Function to memory-map the samples of a PCM or floating point WAV clip, without reading or converting them
+# Returns the samples as an array of shape (frames, channels) backed by the file, and the sampling rate,
+# or None if the format cannot be mapped (e.g. 24-bit or compressed WAV), so that the caller decodes the clip
+def memmap_wav(path):
+    mappable = mappable_wav(path)
+    if mappable is None:
+        return None
+    header, dtype = mappable
+
+    samples = np.memmap(path, dtype=dtype, mode='r', offset=header.data_offset,
+                        shape=(header.frames, header.channels))
+    return samples, header.sample_rate
+
+
+# Function to decode an audio clip in process with libsndfile (through soundfile), which reads WAV, FLAC, OGG
+# and, since libsndfile 1.1, MP3 clips. Returns the mono float32 signal and its sampling rate, as librosa.load does
+def soundfile_decode(path):
+    with soundfile.SoundFile(path) as f:
+        samples = f.read(frames=-1, dtype='float32', always_2d=True)
+        return wav_samples_to_float(samples), f.samplerate
+
+
+# Function to find the number of frames and the sampling rate of an audio clip soundfile reads, without decoding it
+def soundfile_length(path):
+    info = soundfile.info(path)
+    return info.frames, info.samplerate
+
+
+# Function to read segments of an audio clip with soundfile one at a time, given as (first, last excluded) frames
+# in increasing order, so that only one segment is held in memory
+# Yields the samples of each segment, of shape (frames, channels), in float32 as soundfile_decode reads them
+def soundfile_segments(path, bounds):
+    with soundfile.SoundFile(path) as f:
+        position = 0
+        for start, stop in bounds:
+            if start != position:
+                f.seek(start)
+            samples = f.read(frames=stop - start, dtype='float32', always_2d=True)
+            position = start + len(samples)
+            yield samples
+
+
+# Function to decode an audio clip with audioread, which streams 16-bit samples from an external decoder
+# (GStreamer, Core Audio or an ffmpeg subprocess). Returns the mono float32 signal and its sampling rate,
+# as librosa.load does when soundfile cannot read the clip
+def audioread_decode(path):
+    with audioread.audio_open(path) as f:
+        sample_rate = f.samplerate
+        channels = f.channels
+        samples = np.frombuffer(b''.join(f), dtype='<i2')
+    samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+    return wav_samples_to_float(samples), sample_rate
+
+
+# Function to decode an audio clip at its native sampling rate into a mono float32 signal
+# The 'auto' decoder tries the in-process soundfile decoder first, and falls back to audioread
+# Returns the signal, its sampling rate and the name of the decoder that produced it
+def decode_clip(path, decoder='auto'):
+    if decoder in ('auto', 'soundfile'):
+        try:
+            y, sample_rate = soundfile_decode(path)
+            return y, sample_rate, 'soundfile'
+        except RuntimeError:
+            if decoder == 'soundfile':
+                raise
+    y, sample_rate = audioread_decode(path)
+    return y, sample_rate, 'audioread'
+
+
+# Function to find which decoder decode_clip uses for an audio clip, without decoding it: 'soundfile' when
+# libsndfile recognises the clip (or is asked for), 'audioread' otherwise
+def resolve_decoder(path, decoder='auto'):
+    if decoder == 'auto':
+        try:
+            soundfile.info(path)
+        except RuntimeError:
+            return 'audioread'
+        return 'soundfile'
+    return decoder
+
+
+# Function to find the key of a clip in a PCM cache: a hash of its absolute path, size and modification time,
+# and of the decoder that decodes it, so that a modified clip is decoded again
+def pcm_cache_key(path, decoder):
+    stat = os.stat(path)
+    identity = "|".join((os.path.abspath(path), str(stat.st_size), str(stat.st_mtime_ns), decoder))
+    return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+
+# Function to look up a decoded clip in the PCM cache folder 'cache_folder'
+# Returns the memory-mapped mono float32 signal, its sampling rate and its cache file, or None if the clip is not
+# cached; a hit marks the entry as the most recently used one
+def read_pcm_cache(cache_folder, key):
+    for cache_file in glob.glob(os.path.join(glob.escape(cache_folder), key + '_*' + PCM_CACHE_SUFFIX)):
+        sample_rate = int(os.path.basename(cache_file)[len(key) + 1:-len(PCM_CACHE_SUFFIX)])
+        try:
+            y = np.load(cache_file, mmap_mode='r')
+            os.utime(cache_file)
+        except (OSError, ValueError):
+            return None
+        return y, sample_rate, cache_file
+    return None
+
+
+# Function to store a decoded clip in the PCM cache folder 'cache_folder', and to evict the least recently used
+# entries beyond 'size_limit' bytes; a clip larger than the whole cache is not stored
+def write_pcm_cache(cache_folder, key, y, sample_rate, size_limit):
+    y = np.asarray(y, dtype=np.float32)
+    if y.nbytes > size_limit:
+        return
+    os.makedirs(cache_folder, exist_ok=True)
+    cache_file = os.path.join(cache_folder, key + '_' + str(sample_rate) + PCM_CACHE_SUFFIX)
+    # written under a temporary name first, so that a concurrent run never maps a partial file
+    partial_file = cache_file + '.' + str(os.getpid())
+    with open(partial_file, 'wb') as f:
+        np.save(f, y)
+    os.replace(partial_file, cache_file)
+    evict_cache_files(cache_folder, PCM_CACHE_SUFFIX, size_limit, cache_file)
+
+
+# Function to delete the least recently used entries (files ending with 'suffix') of the cache folder
+# 'cache_folder' until they take at most 'size_limit' bytes, keeping the entry 'keep_file'
+# Returns the number of evicted entries
+def evict_cache_files(cache_folder, suffix, size_limit, keep_file=None):
+    entries = []
+    for cache_file in glob.glob(os.path.join(glob.escape(cache_folder), '*' + suffix)):
+        try:
+            stat = os.stat(cache_file)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, cache_file))
+    entries.sort()
+
+    total_size = sum(size for mtime, size, cache_file in entries)
+    evicted = 0
+    for mtime, size, cache_file in entries:
+        if total_size <= size_limit:
+            break
+        if cache_file == keep_file:
+            continue
+        try:
+            os.remove(cache_file)
+        except OSError:
+            continue
+        total_size -= size
+        evicted += 1
+    return evicted
+
+
+# Function to decode an audio clip through the PCM cache folder 'cache_folder' of at most 'size_limit' bytes
+# A cached clip is memory-mapped instead of being decoded again; the entries are keyed on the decoder that produced
+# them, so a cached clip holds the samples decode_clip would return
+# Returns the signal, its sampling rate, the name of the decoder that produced it, as decode_clip does,
+# and whether it was read from the cache
+def cached_decode_clip(path, decoder, cache_folder, size_limit):
+    clip_decoder = resolve_decoder(path, decoder)
+    cached = read_pcm_cache(cache_folder, pcm_cache_key(path, clip_decoder))
+    if cached is not None:
+        y, sample_rate, cache_file = cached
+        # the size limit may have been lowered since the cache was filled
+        evict_cache_files(cache_folder, PCM_CACHE_SUFFIX, size_limit, cache_file)
+        return y, sample_rate, clip_decoder, True
+
+    y, sample_rate, clip_decoder = decode_clip(path, decoder)
+    write_pcm_cache(cache_folder, pcm_cache_key(path, clip_decoder), y, sample_rate, size_limit)
+    return y, sample_rate, clip_decoder, False
+
+
+# Function to convert a slice of WAV or decoded samples of shape (frames, channels) into a mono float32 signal
+# Follows the conversion of librosa.load: integers are scaled to [-1, 1),
+# and the channels are averaged
+def wav_samples_to_float(samples):
+    if samples.dtype.kind == 'u':
+        y = (samples.astype(np.float32) - 128) / np.float32(128)
+    elif samples.dtype.kind == 'i':
+        y = samples.astype(np.float32) / np.float32(2 ** (8 * samples.dtype.itemsize - 1))
+    else:
+        y = samples.astype(np.float32)
+
+    if y.shape[1] == 1:
+        return y[:, 0]
+    return np.mean(y, axis=1)
+
+
+# Function to decode the 4-byte header of an MPEG audio frame
+def parse_mp3_frame_header(data, pos):
+    if pos + 4 > len(data):
+        return None
+    h = struct.unpack('>I', data[pos:pos + 4])[0]
+    if (h >> 21) & 0x7FF != 0x7FF:
+        return None
+
+    version = {0: 2.5, 2: 2, 3: 1}.get((h >> 19) & 3)
+    layer = {1: 3, 2: 2, 3: 1}.get((h >> 17) & 3)
+    bitrate_index = (h >> 12) & 0xF
+    rate_index = (h >> 10) & 3
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    bitrate = MPEG_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    rate = MPEG_SAMPLE_RATES[version][rate_index]
+    padding = (h >> 9) & 1
+    mono = (h >> 6) & 3 == 3
+
+    if layer == 1:
+        samples = 384
+        frame_bytes = (12 * bitrate // rate + padding) * 4
+    elif layer == 2 or version == 1:
+        samples = 1152
+        frame_bytes = 144 * bitrate // rate + padding
+    else:
+        samples = 576
+        frame_bytes = 72 * bitrate // rate + padding
+
+    return MP3Frame(version, layer, rate, mono, frame_bytes, samples)
+
+
+# Function to skip the ID3v2 tag found at the beginning of many MP3 files
+def skip_id3v2(data):
+    if len(data) >= 10 and data[0:3] == b'ID3':
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+# Function to locate the first MPEG audio frame, confirmed by a valid header of the frame following it
+def find_first_mp3_frame(data, start):
+    end = min(len(data), start + MP3_SYNC_SEARCH_BYTES)
+    pos = data.find(b'\xff', start, end)
+    while pos != -1:
+        frame = parse_mp3_frame_header(data, pos)
+        if frame is not None and parse_mp3_frame_header(data, pos + frame.frame_bytes) is not None:
+            return pos, frame
+        pos = data.find(b'\xff', pos + 1, end)
+    return None, None
+
+
+# Function to read the encoder information frame (Xing/Info or VBRI) written in front of the audio frames
+# Returns the number of audio frames and the number of encoder delay and padding samples, or None if absent
+def read_mp3_info_frame(data, pos, frame):
+    if frame.version == 1:
+        side_info = 17 if frame.mono else 32
+    else:
+        side_info = 9 if frame.mono else 17
+
+    xing = pos + 4 + side_info
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing + 4:xing + 8])[0]
+        if not flags & 1:
+            return None
+        frames = struct.unpack('>I', data[xing + 8:xing + 12])[0]
+
+        # LAME extension, holding the encoder delay and padding used for gapless decoding
+        lame = xing + 8 + 4 * bin(flags & 0xB).count('1') + (100 if flags & 4 else 0)
+        delay = padding = 0
+        if data[lame:lame + 4] in (b'LAME', b'Lavf', b'Lavc', b'GOGO'):
+            b = data[lame + 21:lame + 24]
+            if len(b) == 3:
+                delay = (b[0] << 4) | (b[1] >> 4)
+                padding = ((b[1] & 0xF) << 8) | b[2]
+        return frames, delay, padding
+
+    vbri = pos + 4 + 32
+    if data[vbri:vbri + 4] == b'VBRI':
+        frames = struct.unpack('>I', data[vbri + 14:vbri + 18])[0]
+        return frames, 0, 0
+
+    return None
+
+
+# Function to count the audio frames of an MP3 clip by walking its frame headers
+# Returns None if the frame chain breaks before the trailing tags, as the header is then not trustworthy
+def count_mp3_frames(data, pos):
+    frames = 0
+    while pos < len(data):
+        frame = parse_mp3_frame_header(data, pos)
+        if frame is None:
+            trailer = data[pos:pos + 8]
+            if trailer[0:3] == b'TAG' or trailer == b'APETAGEX' or trailer[0:6] == b'LYRICS':
+                break
+            return None
+        frames += 1
+        pos += frame.frame_bytes
+    return frames
+
+
+# Function to find the duration (in seconds) of an MP3 clip from its frame headers, without decoding it
+def mp3_duration(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pos, frame = find_first_mp3_frame(data, skip_id3v2(data))
+            if frame is None:
+                return None
+
+            info = read_mp3_info_frame(data, pos, frame)
+            if info is not None:
+                frames, delay, padding = info
+                samples = frames * frame.samples - delay - padding
+            else:
+                frames = count_mp3_frames(data, pos)
+                if frames is None:
+                    return None
+                samples = frames * frame.samples
+
+    if samples <= 0:
+        return None
+    return samples / frame.sample_rate
+
+
+# Function to find the duration (in seconds) of an audio clip using only its container header
+# Returns None when the header is missing or cannot be trusted, so that the caller decodes the clip instead
+def probe_duration(path):
+    try:
+        duration = wav_duration(path)
+        if duration is None and path.lower().endswith('.mp3'):
+            duration = mp3_duration(path)
+    except (OSError, ValueError, struct.error):
+        duration = None
+    return duration
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Script to measure how the pre-clustering of the neighboring
+voiced segments and the admission of the speakers scale
+with the number of segments, on synthetic segments drawn
+around a few speakers
+
+The vectorized merging and admission of
+'unsupervised_speaker_count' are timed up to 100000
+segments, and checked against the pairwise merging passes
+and admission loop as long as those stay affordable; the
+admission is also checked against the admission block by
+block of the streaming pipeline
+"""
+
+import io
+import sys
+from contextlib import redirect_stdout
+from time import process_time
+import numpy as np
+import feature_io
+import unsupervised_speaker_count as usc
+
+# Numbers of segments to time, and largest number of segments merged pair by pair as well
+SEGMENT_COUNTS = (1000, 3000, 10000, 30000, 100000)
+PAIRWISE_SEGMENT_COUNT_UPPER = 10000
+
+# Synthetic segments: runs of segments of the same speaker, with noisy average MFCC vectors
+SPEAKER_COUNT = 6
+RUN_LENGTH = 8
+FRAME_COUNT = 4
+MFCC_NOISE = 4.0
+
+
+# Function to draw 'segment_count' synthetic voiced segments, as the feature table of the rev.MFCC file
+def synthetic_segments(segment_count, seed=0):
+    rng = np.random.default_rng(seed)
+    n_columns = usc.n_mfcc - 1
+    centers = rng.normal(0, 10, (SPEAKER_COUNT, n_columns)) + 30 * np.eye(n_columns)[:SPEAKER_COUNT]
+    pitches = rng.choice([110, 130, 190, 220], SPEAKER_COUNT)
+
+    speakers = np.repeat(rng.integers(0, SPEAKER_COUNT, segment_count // RUN_LENGTH + 1), RUN_LENGTH)[:segment_count]
+    mfcc = centers[speakers, None, :] + rng.normal(0, MFCC_NOISE, (segment_count, FRAME_COUNT, n_columns))
+    pitch = pitches[speakers] + rng.normal(0, 5, segment_count)
+
+    return feature_io.matrix_table((1, np.arange(1, segment_count + 1), pitch, FRAME_COUNT),
+                                   mfcc.reshape(segment_count, -1), feature_io.VOICED_SEGMENT_FIELDS)
+
+
+# Function to admit the speakers of a feature table of merged segments ADMISSION_BLOCK segments at a time, as the
+# streaming pipeline does
+def admit_speakers_in_blocks(merged):
+    rows = list(feature_io.table_rows(merged))
+    speaker_table = None
+    for start in range(0, len(rows), usc.ADMISSION_BLOCK):
+        speaker_table = usc.admit_speakers(feature_io.feature_table(rows[start:start + usc.ADMISSION_BLOCK],
+                                                                    feature_io.VOICED_SEGMENT_FIELDS,
+                                                                    feature_io.SUM_TYPE), speaker_table)
+    return speaker_table
+
+
+# Function to time the merging of the neighboring segments and the admission of the speakers
+# for every number of segments
+def main():
+    print("Segments", "Merged Segments", "Merging (s)", "Pairwise Merging (s)",
+          "Speakers", "Admission (s)", "Pairwise Admission (s)", sep="\t")
+    for segment_count in SEGMENT_COUNTS:
+        segments = synthetic_segments(segment_count)
+
+        start = process_time()
+        merged = usc.merge_neighbor_segments(segments)
+        vectorized_time = process_time() - start
+
+        pairwise_time = "-"
+        if segment_count <= PAIRWISE_SEGMENT_COUNT_UPPER:
+            start = process_time()
+            pairwise_merged = usc.merge_neighbor_segments_pairwise(list(feature_io.table_rows(segments)))
+            pairwise_time = round(process_time() - start, 3)
+            if pairwise_merged != list(feature_io.table_rows(merged)):
+                sys.exit("Vectorized and pairwise merging differ for " + str(segment_count) + " segments")
+            if pairwise_merged != list(usc.merge_segment_stream(feature_io.table_rows(segments))):
+                sys.exit("Streaming and pairwise merging differ for " + str(segment_count) + " segments")
+
+        start = process_time()
+        speakers = usc.admit_speakers(merged)
+        admission_time = process_time() - start
+        if list(feature_io.table_rows(admit_speakers_in_blocks(merged))) != list(feature_io.table_rows(speakers)):
+            sys.exit("Streaming and vectorized admission differ for " + str(segment_count) + " segments")
+
+        pairwise_admission_time = "-"
+        if segment_count <= PAIRWISE_SEGMENT_COUNT_UPPER:
+            start = process_time()
+            # the pairwise admission prints every comparison
+            with redirect_stdout(io.StringIO()):
+                pairwise_speakers = usc.admit_speakers_pairwise(list(feature_io.table_rows(merged)))
+            pairwise_admission_time = round(process_time() - start, 3)
+            if pairwise_speakers != list(feature_io.table_rows(speakers)):
+                sys.exit("Vectorized and pairwise admission differ for " + str(segment_count) + " segments")
+
+        print(segment_count, len(merged.header), round(vectorized_time, 3), pairwise_time,
+              len(speakers.header), round(admission_time, 3), pairwise_admission_time, sep="\t")
+
+
+# Using the special variable __name__
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Module to keep a manifest of the audio clips of a speech
+folder, so that incremental runs only process the clips
+added or modified since the previous run
+
+The manifest "manifest.json" lists every clip by name
+with its size, modification time and content hash, and
+what the scripts stored for it: the key of its features
+in the feature store next to the manifest (entries of
+the feature_cache format) and its per-clip results, each
+with the key of the parameters they were computed with.
+A clip whose content changes loses everything stored for
+it; a clip that is only touched keeps it.
+"""
+
+import os
+import json
+import feature_cache
+
+MANIFEST_FILE = 'manifest.json'
+
+
+# Function to read the manifest kept in 'manifest_folder', or start an empty one
+def read_manifest(manifest_folder):
+    try:
+        with open(os.path.join(manifest_folder, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    manifest.setdefault('clips', {})
+    return manifest
+
+
+# Function to write the manifest to 'manifest_folder'
+def write_manifest(manifest_folder, manifest):
+    os.makedirs(manifest_folder, exist_ok=True)
+    manifest_file = os.path.join(manifest_folder, MANIFEST_FILE)
+    # written under a temporary name first, so that an interrupted run leaves the previous manifest
+    partial_file = manifest_file + '.' + str(os.getpid())
+    with open(partial_file, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(partial_file, manifest_file)
+
+
+# Function to find the manifest entry of the clip 'file' of the folder 'folder_name', bringing its identity up to
+# date: the clip is hashed again only if its size or modification time changed, and its stored features and
+# results are dropped only if its content changed
+# The hash of the clip is given to feature_cache.content_hash, so that the feature cache does not hash it again
+def clip_entry(manifest, folder_name, file):
+    stat = os.stat(os.path.join(folder_name, file))
+    entry = manifest['clips'].get(file)
+    if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        feature_cache.remember_content_hash(os.path.join(folder_name, file), entry['sha256'])
+        return entry
+
+    clip_hash = feature_cache.content_hash(os.path.join(folder_name, file))
+    if entry is None or entry['sha256'] != clip_hash:
+        entry = {'sha256': clip_hash}
+    entry['size'] = stat.st_size
+    entry['mtime_ns'] = stat.st_mtime_ns
+    manifest['clips'][file] = entry
+    return entry
+
+
+# Function to find the key of a set of parameters, stored with the features and the results of a clip
+def parameters_key(parameters):
+    return feature_cache.feature_cache_key('', parameters)
+
+
+# Function to remove from the manifest the clips that are no longer among 'files', and to delete from the feature
+# store in 'manifest_folder' the features no clip refers to any more
+# Returns the number of removed clips
+def prune_manifest(manifest_folder, manifest, files):
+    removed = [file for file in manifest['clips'] if file not in files]
+    for file in removed:
+        del manifest['clips'][file]
+
+    keys = set(entry.get('features') for entry in manifest['clips'].values())
+    if os.path.isdir(manifest_folder):
+        for name in os.listdir(manifest_folder):
+            if name.endswith(feature_cache.FEATURE_CACHE_SUFFIX) and \
+                    name[:-len(feature_cache.FEATURE_CACHE_SUFFIX)] not in keys:
+                os.remove(os.path.join(manifest_folder, name))
+    return len(removed)
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Module to pre-cluster the neighboring voiced segments
+with NumPy arrays, following the merging passes of the
+speaker counting scripts over segments summarized by the
+column sums of their MFCC matrices and their frame counts
+"""
+
+import math
+import numpy as np
+from numpy import linalg as la
+
+# Distance (in degrees) to a threshold below which the vectorized angle of a segment pair
+# is computed again pair by pair, so that both computations take the same decisions
+ANGLE_TOLERANCE = 1e-6
+# Same distance for the angles looked up in a single precision angle matrix
+MATRIX_ANGLE_TOLERANCE = 1e-4
+
+
+# Function to find the angle (in degrees) between two average MFCC vectors
+def vector_angle(mfcc_a, mfcc_b):
+    cosine_distance = np.dot(mfcc_a, mfcc_b) / (la.norm(mfcc_a) * la.norm(mfcc_b))
+
+    # keep rounding errors of (nearly) identical vectors inside the domain of acos
+    radian_distance = math.acos(min(max(cosine_distance, -1.0), 1.0))
+    return math.degrees(radian_distance)
+
+
+# Function to find the angles (in degrees) between the rows of two matrices of average MFCC vectors
+# The angles lying within ANGLE_TOLERANCE of one of the 'thresholds' are those of vector_angle
+def pair_angles(mfcc_a, mfcc_b, thresholds):
+    cosine_distance = np.einsum('ij,ij->i', mfcc_a, mfcc_b) / (la.norm(mfcc_a, axis=1) * la.norm(mfcc_b, axis=1))
+    angles = np.degrees(np.arccos(np.clip(cosine_distance, -1.0, 1.0)))
+
+    for i in np.flatnonzero(np.any(np.abs(angles[:, None] - np.asarray(thresholds)) <= ANGLE_TOLERANCE, axis=1)):
+        angles[i] = vector_angle(mfcc_a[i], mfcc_b[i])
+    return angles
+
+
+# Function to estimate the gender of every pitch value: 0 for male, 1 for female, -1 if uncertain
+def gender_codes(pitch, male_upper, female_lower):
+    if np.ndim(pitch) == 0:
+        return 0 if pitch <= male_upper else 1 if pitch >= female_lower else -1
+    pitch = np.asarray(pitch)
+    return np.where(pitch <= male_upper, 0, np.where(pitch >= female_lower, 1, -1))
+
+
+# Function to decide on the gender similarity of pitch pairs: 1 for the same gender, 0 for different genders,
+# and -1 if the gender of either pitch is uncertain
+def gender_decisions(pitch_a, pitch_b, male_upper, female_lower):
+    gender_a = gender_codes(pitch_a, male_upper, female_lower)
+    gender_b = gender_codes(pitch_b, male_upper, female_lower)
+    return np.where((gender_a == -1) | (gender_b == -1), -1, (gender_a == gender_b).astype(int))
+
+
+# Function to compute the angles (in degrees) between all the pairs of average MFCC vectors, and the gender
+# decisions (as gender_decisions) of all the pairs of pitches, 'block_rows' rows at a time
+# The angles are written to 'angles' (float32) and the decisions to 'decisions' (int8), both of shape (n, n),
+# which may be memory-mapped files; returns the number of pairs (i < j) within 'same_distance' degrees and
+# the number of pairs 'diff_distance' degrees apart or more
+def angle_matrix(mfcc_mean, pitch, angles, decisions, block_rows, same_distance, diff_distance, male_upper,
+                 female_lower):
+    mfcc_mean = np.asarray(mfcc_mean, dtype=np.float64)
+    norms = la.norm(mfcc_mean, axis=1)
+    genders = gender_codes(pitch, male_upper, female_lower)
+    uncertain = genders == -1
+
+    same_count = 0
+    diff_count = 0
+    for start in range(0, len(mfcc_mean), block_rows):
+        stop = min(start + block_rows, len(mfcc_mean))
+        cosine_distance = (mfcc_mean[start:stop] @ mfcc_mean.T) / (norms[start:stop, None] * norms)
+        block_angles = np.degrees(np.arccos(np.clip(cosine_distance, -1.0, 1.0)))
+        angles[start:stop] = block_angles
+        decisions[start:stop] = np.where(uncertain[start:stop, None] | uncertain,
+                                         -1, genders[start:stop, None] == genders)
+
+        upper = np.arange(start, stop)[:, None] < np.arange(len(mfcc_mean))
+        same_count += np.count_nonzero(upper & (block_angles <= same_distance))
+        diff_count += np.count_nonzero(upper & (block_angles >= diff_distance))
+
+    return same_count, diff_count
+
+
+# Function to merge matching neighbor segments until no neighbors match, as the passes of merge_neighbor_segments
+# Segment i is given by the column sums 'mfcc_sum[i]' of its MFCC matrix, its frame count and its pitch; two
+# neighbors match if their average MFCC vectors lie within 'same_distance' degrees and their pitches tell the
+# same gender. A matching right neighbor is absorbed: the column sums and the frame counts add up, and the pitch
+# is the average of both pitches
+#
+# A pass walks the neighbors from left to right and merges each segment with its right neighbors for as long as
+# they match. All the neighbor pairs are decided at once before the first pass. A pair can only change its
+# decision once one of its segments has absorbed a neighbor, so every following pass only decides, at once,
+# the pairs around the segments that changed in the previous pass, and walks the pairs that match among them.
+# The sums are added up merge by merge, in the same order as the passes, so that the rounding is the same.
+# The angles and the gender decisions of the segment pairs can be given by the matrices of angle_matrix, to
+# be looked up for the first pass instead of computed
+# Returns the indices of the remaining segments, with their column sums, frame counts and pitches
+def merge_neighbor_runs(mfcc_sum, frame_count, pitch, same_distance, male_upper, female_lower, angles=None,
+                        decisions=None):
+    mfcc_sum = np.array(mfcc_sum, dtype=np.float64)
+    frame_count = np.array(frame_count, dtype=np.int64)
+    pitch = np.array(pitch, dtype=np.float64)
+    n = len(pitch)
+
+    # doubly linked list of the remaining segments; n marks the end of the list and -1 its beginning
+    next_segment = np.arange(1, n + 1)
+    previous_segment = np.arange(-1, n - 1)
+    alive = np.ones(n, dtype=bool)
+
+    # Decide the pairs (p, next_segment[p]) whose left segment p is in 'lefts', at once
+    def matching_pairs(lefts):
+        rights = next_segment[lefts]
+        angles = pair_angles(mfcc_sum[lefts] / frame_count[lefts, None],
+                             mfcc_sum[rights] / frame_count[rights, None], (same_distance,))
+        decisions = gender_decisions(pitch[lefts], pitch[rights], male_upper, female_lower)
+        return lefts[(angles <= same_distance) & (decisions == 1)]
+
+    # Decide a single pair, as merge_neighbors does
+    def pair_matches(p, q):
+        gender_p = gender_codes(pitch[p], male_upper, female_lower)
+        if gender_p == -1 or gender_p != gender_codes(pitch[q], male_upper, female_lower):
+            return False
+        return vector_angle(mfcc_sum[p] / frame_count[p], mfcc_sum[q] / frame_count[q]) <= same_distance
+
+    # Look up the pairs of the first pass, deciding again those lying near the threshold in single precision
+    def looked_up_matching_pairs(lefts):
+        pair_angle = np.asarray(angles[lefts, lefts + 1], dtype=np.float64)
+        for i in np.flatnonzero(np.abs(pair_angle - same_distance) <= MATRIX_ANGLE_TOLERANCE):
+            p = lefts[i]
+            pair_angle[i] = vector_angle(mfcc_sum[p] / frame_count[p], mfcc_sum[p + 1] / frame_count[p + 1])
+        return lefts[(pair_angle <= same_distance) & (np.asarray(decisions[lefts, lefts + 1]) == 1)]
+
+    lefts = np.arange(n - 1)
+    first_pass = angles is not None
+    while len(lefts) > 0:
+        changed = []
+        matching = looked_up_matching_pairs(lefts) if first_pass else matching_pairs(lefts)
+        first_pass = False
+        for p in matching.tolist():
+            # the segment was absorbed by a left neighbor earlier in this pass
+            if not alive[p]:
+                continue
+
+            q = next_segment[p]
+            while True:
+                mfcc_sum[p] += mfcc_sum[q]
+                frame_count[p] += frame_count[q]
+                pitch[p] = (pitch[p] + pitch[q]) / 2
+                alive[q] = False
+                next_segment[p] = next_segment[q]
+                if next_segment[q] < n:
+                    previous_segment[next_segment[q]] = p
+
+                q = next_segment[p]
+                if q == n or not pair_matches(p, q):
+                    break
+            changed.append(p)
+
+        # the pairs on both sides of the segments that absorbed a neighbor are decided again in the next pass
+        changed = np.array(changed, dtype=np.int64)
+        lefts = np.union1d(changed, previous_segment[changed])
+        lefts = lefts[(lefts >= 0) & alive[np.maximum(lefts, 0)]]
+        lefts = lefts[next_segment[lefts] < n]
+
+    remaining = np.flatnonzero(alive)
+    return remaining, mfcc_sum[remaining], frame_count[remaining], pitch[remaining]
+
+
+# Function to find the cosines bounding the angles that lie within ANGLE_TOLERANCE of 'same_distance' or
+# 'diff_distance' (in degrees), in increasing order, to place the cosine of an angle by np.searchsorted: in an odd
+# region if the angle lies within ANGLE_TOLERANCE of a threshold, in a region up to 'apart_region' if it is
+# 'diff_distance' degrees or more, and in a region from 'match_region' if it is within 'same_distance' degrees and
+# below 'diff_distance' degrees
+# With thresholds too close to each other or to 0 or 180 degrees, all the cosines lie in the single odd region
+# Returns the cosines, 'apart_region' and 'match_region'
+def threshold_regions(same_distance, diff_distance):
+    upper, lower = max(same_distance, diff_distance), min(same_distance, diff_distance)
+    if lower <= ANGLE_TOLERANCE or upper >= 180 - ANGLE_TOLERANCE or upper - lower <= 2 * ANGLE_TOLERANCE:
+        return np.array([-np.inf, np.inf]), 0, 2
+    bounds = (upper + ANGLE_TOLERANCE, upper - ANGLE_TOLERANCE, lower + ANGLE_TOLERANCE, lower - ANGLE_TOLERANCE)
+    return np.cos(np.radians(bounds)), 0 if diff_distance == upper else 2, 4
+
+
+# Function to admit the speakers of a list of merged segments, as admit_speakers does pair by pair: the first
+# segment is admitted as speaker 1, and every following segment is merged into the first matching speaker, or
+# admitted as a new speaker if it differs from all of them
+# A segment differs from a speaker if their pitches tell different genders or their average MFCC vectors lie
+# 'diff_distance' degrees apart or more, and matches it if their pitches tell the same gender and their average
+# MFCC vectors lie within 'same_distance' degrees. The unit average MFCC vectors (centroids) of the speakers are
+# held in the rows of a preallocated matrix, so that a segment is compared with all the speakers by one
+# matrix-vector product, and the cosines are placed between the thresholds by one search: only the angles lying
+# within ANGLE_TOLERANCE of a threshold are computed, by vector_angle
+# With 'speakers', the column sums, frame counts and pitches of the speakers admitted from earlier segments, the
+# admission carries on from those speakers instead of admitting the first segment
+# Returns the indices of the segments that opened each speaker (-1 for the speakers given in 'speakers'), with the
+# column sums, frame counts and pitches of the speakers
+def admit_speaker_runs(mfcc_sum, frame_count, pitch, same_distance, diff_distance, male_upper, female_lower,
+                       speakers=None):
+    mfcc_sum = np.array(mfcc_sum, dtype=np.float64)
+    frame_count = np.array(frame_count, dtype=np.int64)
+    pitch = np.array(pitch, dtype=np.float64)
+    n = len(pitch)
+    n_columns = mfcc_sum.shape[1]
+    speaker_count = 0 if speakers is None else len(speakers[2])
+    capacity = speaker_count + n
+
+    speaker_segment = np.full(capacity, -1, dtype=np.int64)
+    speaker_sum = np.zeros((capacity, n_columns), dtype=np.float64)
+    speaker_mean = np.zeros((capacity, n_columns), dtype=np.float64)
+    speaker_unit = np.zeros((capacity, n_columns), dtype=np.float64)
+    speaker_frame_count = np.zeros(capacity, dtype=np.int64)
+    speaker_pitch = np.zeros(capacity, dtype=np.float64)
+    speaker_gender = np.zeros(capacity, dtype=np.int64)
+    if speaker_count > 0:
+        k = speaker_count
+        speaker_sum[:k], speaker_frame_count[:k], speaker_pitch[:k] = speakers
+        speaker_mean[:k] = speaker_sum[:k] / speaker_frame_count[:k, None]
+        speaker_unit[:k] = speaker_mean[:k] / la.norm(speaker_mean[:k], axis=1)[:, None]
+        speaker_gender[:k] = gender_codes(speaker_pitch[:k], male_upper, female_lower)
+
+    means = mfcc_sum / frame_count[:, None]
+    units = means / la.norm(means, axis=1)[:, None]
+    # the scalars of the segments are read from lists, as Python numbers
+    segment_frame_count = frame_count.tolist()
+    segment_pitch = pitch.tolist()
+    genders = gender_codes(pitch, male_upper, female_lower).tolist()
+
+    cosine_bounds, apart_region, match_region = threshold_regions(same_distance, diff_distance)
+
+    for i in range(n):
+        gender = genders[i]
+
+        if speaker_count > 0:
+            k = speaker_count
+            region = np.searchsorted(cosine_bounds, speaker_unit[:k] @ units[i])
+            borderline = np.flatnonzero(region & 1)
+            for j in borderline.tolist():
+                angle = vector_angle(speaker_mean[j], means[i])
+                region[j] = 0 if angle >= diff_distance else match_region if angle <= same_distance \
+                    else match_region - 1
+
+            if gender == -1:
+                # the gender of the segment is uncertain, so it only differs from a speaker by their angle
+                matching_speaker = -1
+            else:
+                matching = (region >= match_region) & (speaker_gender[:k] == gender)
+                matching_speaker = int(matching.argmax())
+                if not matching[matching_speaker]:
+                    matching_speaker = -1
+
+            if matching_speaker >= 0:
+                # merge the segment into the first matching speaker
+                j = matching_speaker
+                merged_frame_count = speaker_frame_count[j] + segment_frame_count[i]
+                speaker_pitch[j] = (speaker_pitch[j] * merged_frame_count + segment_pitch[i] * segment_frame_count[i]) \
+                    / (merged_frame_count + segment_frame_count[i])
+                speaker_frame_count[j] = merged_frame_count
+                speaker_sum[j] += mfcc_sum[i]
+                speaker_mean[j] = speaker_sum[j] / merged_frame_count
+                speaker_unit[j] = speaker_mean[j] / math.sqrt(speaker_mean[j] @ speaker_mean[j])
+                speaker_gender[j] = gender_codes(speaker_pitch[j], male_upper, female_lower)
+                continue
+
+            # neither a match nor different from all the speakers: the segment is left out
+            different = region <= apart_region
+            if gender != -1:
+                different |= (speaker_gender[:k] != gender) & (speaker_gender[:k] != -1)
+            if not different.all():
+                continue
+
+        speaker_segment[speaker_count] = i
+        speaker_sum[speaker_count] = mfcc_sum[i]
+        speaker_mean[speaker_count] = means[i]
+        speaker_unit[speaker_count] = units[i]
+        speaker_frame_count[speaker_count] = segment_frame_count[i]
+        speaker_pitch[speaker_count] = segment_pitch[i]
+        speaker_gender[speaker_count] = gender
+        speaker_count += 1
+
+    k = speaker_count
+    return speaker_segment[:k], speaker_sum[:k], speaker_frame_count[:k], speaker_pitch[:k]
@@ -14,7 +14,10 @@ Created on Sun May 30 01:04:57 2021
 import os
 import glob
 import sys
+import argparse
 import unsupervised_speaker_count as usc
+import clip_manifest
+import feature_cache
 import generate_plots_processing_time as gpp
 import generate_plots_segment_count as gps
 import shutil
@@ -29,104 +32,147 @@ import matplotlib.pyplot as plt
 path = os.getcwd()
 os.chdir(path)
 
-# Find Total number of arguments passed to the script
-n = len(sys.argv)
-
-if n < 2:
-    exit("\nPlease include recorded clips in a directory and\n" + "pass the directory path as command line argument")
-
-# Input Audio Details
-speech_folder_name = sys.argv[1]
-
-if os.path.exists(speech_folder_name) is False:
-    sys.exit("\nFolder \"" + speech_folder_name + "\" not found. Check the Speech folder path")
-
 # tuple of supported audio file extensions
 file_extension = ('.mp3', '.wav')
 
 # Temporary intermediate files for processing
 temporary_directory = "tempdir"
-temporary_directory_path = os.path.join(speech_folder_name, temporary_directory)
 temporary_directory2 = "temp"
-temporary_directory_path2 = os.path.join(speech_folder_name, temporary_directory2)
-
-if os.path.exists(temporary_directory_path) is False:
-    os.makedirs(temporary_directory_path)
-else:
-    shutil.rmtree(temporary_directory_path)
-    sleep(1.0)
-    os.makedirs(temporary_directory_path)
-
-if os.path.exists(temporary_directory_path2) is False:
-    os.makedirs(temporary_directory_path2)
-else:
-    shutil.rmtree(temporary_directory_path2)
-    sleep(1.0)
-    os.makedirs(temporary_directory_path2)
 
 output_file_extension = ".txt"
 fig_file_extension = ".png"
 # meta_file_extension = ".csv"
-metadata_file = speech_folder_name + '/temp/MetaData' + output_file_extension
-
-yin_file = speech_folder_name + '/temp/YIN' + output_file_extension
-mfcc_file = speech_folder_name + '/temp/MFCC' + output_file_extension
-rev_mfcc_file = speech_folder_name + '/temp/rev.MFCC' + output_file_extension
-merged_mfcc_file = speech_folder_name + '/temp/merged.MFCC' + output_file_extension
-
-# SEGMENT_LENGTH = usc.SEGMENT_LENGTH
 
+# Suppress the "Empty filters detected in mel frequency basis" warning by Librosa, as unsupervised_speaker_count does
 if not sys.warnoptions:
     import warnings
 
-    warnings.simplefilter("ignore")
+    warnings.filterwarnings("ignore", message="Empty filters detected in mel frequency basis")
 
 
-def evaluate_speech_clips():
-    if not os.listdir(speech_folder_name):
-        sys.exit("No file in folder \"" + speech_folder_name + "\"")
+# Function to key the results of the audio clip 'path' in the manifest of an incremental run: the parameters its
+# features depend on, with the decoder that reads it, and the parameters of the count
+def results_parameters_key(path):
+    return clip_manifest.parameters_key(dict(usc.feature_parameters(usc.SEGMENT_LENGTH, usc.clip_decoder_name(path)),
+                                             same=usc.MFCC_DIST_SAME_UN, diff=usc.MFCC_DIST_DIFF_UN,
+                                             streaming=usc.streaming))
 
-    file_count = 0
-    file_metadata_List = [('Serial', "Audio File Name", "Clip Length", "Speech Recorder", "Recording Date",
-            "Recording Time", "#Segments", "#Voiced Segments", "#Merged Segments", "#Speakers", "Computation Time"),]
 
-    for file in os.listdir(speech_folder_name):
-        # Check the extension of the file
-        if file.endswith(file_extension):
-            file_count += 1
-            rel_file_path = speech_folder_name + f"/{file}"
+# Function to count the speakers of every audio clip of 'speech_folder_name' on its own, and to plot the results
+# in the plot style 'plot_style' (see generate_plots_segment_count), if given
+def evaluate_speech_clips(speech_folder_name, plot_style=None):
+    temporary_directory_path = os.path.join(speech_folder_name, temporary_directory)
+    temporary_directory_path2 = os.path.join(speech_folder_name, temporary_directory2)
 
-            print("File Count:", file_count, "File Name:", file)
+    if os.path.exists(temporary_directory_path) is False:
+        os.makedirs(temporary_directory_path)
+    else:
+        shutil.rmtree(temporary_directory_path)
+        sleep(1.0)
+        os.makedirs(temporary_directory_path)
 
-            # Copy files, but preserve metadata (cp -p src dst)
-            shutil.copy2(rel_file_path, temporary_directory_path)
+    if os.path.exists(temporary_directory_path2) is False:
+        os.makedirs(temporary_directory_path2)
+    else:
+        shutil.rmtree(temporary_directory_path2)
+        sleep(1.0)
+        os.makedirs(temporary_directory_path2)
 
-            # Revise the copied file path
-            revised_file_path = temporary_directory_path + f"/{file}"
+    metadata_file = speech_folder_name + '/temp/MetaData' + output_file_extension
 
-            # extract the name of the file (without file extension)
-            file_name = os.path.splitext(file)[0]
-            # split file_name entries by '_' character
-            items = file_name.split('_')
-            audio_owner = items[0]
-            audio_record_date = datetime.date(int(items[3]), int(items[2]),int(items[1])).strftime("%d %b %Y")
-            audio_record_time = datetime.time(int(items[4]), int(items[5]),int(items[6])).strftime("%H:%M:%S")
+    feature_file_extension = usc.feature_file_extension
+    yin_file = speech_folder_name + '/temp/YIN' + feature_file_extension
+    mfcc_file = speech_folder_name + '/temp/MFCC' + feature_file_extension
+    rev_mfcc_file = speech_folder_name + '/temp/rev.MFCC' + feature_file_extension
+    merged_mfcc_file = speech_folder_name + '/temp/merged.MFCC' + feature_file_extension
 
-            speech_duration = usc.find_clip_length(path=revised_file_path)
-            print("Audio Length:", speech_duration)
+    # With "--incremental", the results of every clip are kept in the manifest of the speech folder (see
+    # clip_manifest) and only computed again for the clips added or modified since the previous run, or when the
+    # parameters change
+    incremental = usc.incremental
+    manifest_folder = os.path.join(speech_folder_name, usc.incremental_directory)
 
-            start = process_time()
+    if not os.listdir(speech_folder_name):
+        sys.exit("No file in folder \"" + speech_folder_name + "\"")
+
+    file_count = 0
+    file_metadata_List = [('Serial', "Audio File Name", "Clip Length", "Speech Recorder", "Recording Date",
+            "Recording Time", "#Segments", "#Voiced Segments", "#Merged Segments", "#Speakers", "Computation Time"),]
+
+    # Check the extension of the files
+    files = [file for file in os.listdir(speech_folder_name) if file.endswith(file_extension)]
+
+    if incremental:
+        manifest = clip_manifest.read_manifest(manifest_folder)
+        reused_count = 0
+        entries = [clip_manifest.clip_entry(manifest, speech_folder_name, file) for file in files]
+        results_keys = [results_parameters_key(speech_folder_name + f"/{file}") for file in files]
+        reusable = [entry.get('results') is not None and entry['results']['parameters'] == results_key
+                    for entry, results_key in zip(entries, results_keys)]
+    else:
+        reusable = [False] * len(files)
+
+    # With "--prefetch", the clips to count are fetched (read from the feature cache, or decoded) by a background
+    # thread, ahead of their counting; each clip is counted alone, as the first clip of the temporary folder
+    if usc.prefetch_depth > 0:
+        fetched_clips = usc.prefetched([speech_folder_name + f"/{file}" for file, reuse in zip(files, reusable)
+                                        if not reuse], usc.prefetch_depth,
+                                       lambda path: usc.fetch_clip(1, path, usc.SEGMENT_LENGTH))
+
+    for file, reuse in zip(files, reusable):
+        file_count += 1
+        rel_file_path = speech_folder_name + f"/{file}"
+
+        print("File Count:", file_count, "File Name:", file)
+
+        if reuse:
+            entry = entries[file_count - 1]
+            file_metadata_List.append((file_count, file) + tuple(entry['results']['row']))
+            reused_count += 1
+            continue
+
+        # Copy files, but preserve metadata (cp -p src dst)
+        shutil.copy2(rel_file_path, temporary_directory_path)
+
+        # Revise the copied file path
+        revised_file_path = temporary_directory_path + f"/{file}"
+        if incremental:
+            # the copy keeps the size and modification time of the clip, whose hash is in the manifest
+            feature_cache.remember_content_hash(revised_file_path, entries[file_count - 1]['sha256'])
+
+        # extract the name of the file (without file extension)
+        file_name = os.path.splitext(file)[0]
+        # split file_name entries by '_' character
+        items = file_name.split('_')
+        audio_owner = items[0]
+        audio_record_date = datetime.date(int(items[3]), int(items[2]),int(items[1])).strftime("%d %b %Y")
+        audio_record_time = datetime.time(int(items[4]), int(items[5]),int(items[6])).strftime("%H:%M:%S")
+
+        speech_duration = usc.find_clip_length(path=revised_file_path)
+        print("Audio Length:", speech_duration)
+
+        if usc.prefetch_depth > 0:
+            # the copy is counted from the clip fetched ahead of time
+            usc.preloaded_clips[revised_file_path] = next(fetched_clips)
+
+        start = process_time()
+        # each clip is counted alone in the temporary directory, which is not kept across runs
+        with usc.configured(incremental=False):
             final_speaker_count, total_segments, total_voiced_segments, total_merged_segments = usc.count_speaker(
                 temporary_directory_path, file_extension, yin_file, mfcc_file, rev_mfcc_file, merged_mfcc_file)
-            end = process_time()
-            computation_time = end - start
+        end = process_time()
+        computation_time = end - start
 
-            file_metadata = (file_count, file, speech_duration, audio_owner, audio_record_date, audio_record_time) + \
-                (total_segments, total_voiced_segments, total_merged_segments, final_speaker_count, computation_time)
-            file_metadata_List.append(file_metadata)
+        file_metadata = (file_count, file, speech_duration, audio_owner, audio_record_date, audio_record_time) + \
+            (total_segments, total_voiced_segments, total_merged_segments, final_speaker_count, computation_time)
+        file_metadata_List.append(file_metadata)
+        if incremental:
+            entries[file_count - 1]['results'] = {'parameters': results_keys[file_count - 1],
+                                                  'row': list(file_metadata[2:])}
 
-            # remove the temporary file
-            os.remove(revised_file_path)
+        # remove the temporary file, and its fetched clip if the count did not need it
+        os.remove(revised_file_path)
+        usc.preloaded_clips.pop(revised_file_path, None)
 
 
     # remove the temporary directories
@@ -136,16 +182,46 @@ def evaluate_speech_clips():
         os.remove(f)
     sleep(1.0)
 
+    usc.report_decoders()
+    if incremental:
+        removed_count = clip_manifest.prune_manifest(manifest_folder, manifest, files)
+        clip_manifest.write_manifest(manifest_folder, manifest)
+        print("Incremental run: clips evaluated", file_count - reused_count, "reused", reused_count,
+              "removed", removed_count)
+
     # Generate the metadata file
     usc.file_write(file_metadata_List, metadata_file)
     sleep(2.0)
-    if len(sys.argv) > 2:
-        gps.plot_segment_count(speech_folder_name, output_file_extension, fig_file_extension, sys.argv[2])
-        gpp.plot_processing_time(speech_folder_name, output_file_extension, fig_file_extension, sys.argv[2])
+    if plot_style is not None:
+        gps.plot_segment_count(speech_folder_name, output_file_extension, fig_file_extension, plot_style)
+        gpp.plot_processing_time(speech_folder_name, output_file_extension, fig_file_extension, plot_style)
     else:
         gps.plot_segment_count(speech_folder_name, output_file_extension, fig_file_extension)
         gpp.plot_processing_time(speech_folder_name, output_file_extension, fig_file_extension)
 
+
+# Call the main function
+def main():
+    parser = argparse.ArgumentParser(description="Count the speakers of every audio clip of a speech folder")
+    parser.add_argument("speech_folder", nargs="?", help="folder of the recorded clips")
+    parser.add_argument("plot_style", nargs="?", help="desired plot style (e.g. datewise)")
+    usc.add_options(parser)
+    arguments = parser.parse_args()
+    try:
+        usc.configure(**usc.parsed_options(arguments))
+    except ValueError as error:
+        parser.error(str(error))
+
+    if arguments.speech_folder is None:
+        exit("\nPlease include recorded clips in a directory and\n" +
+             "pass the directory path as command line argument")
+
+    if os.path.exists(arguments.speech_folder) is False:
+        sys.exit("\nFolder \"" + arguments.speech_folder + "\" not found. Check the Speech folder path")
+
+    evaluate_speech_clips(arguments.speech_folder, arguments.plot_style)
+
+
 # Using the special variable __name__
 if __name__ == "__main__":
-    evaluate_speech_clips()
\ No newline at end of file
+    main()
\ No newline at end of file
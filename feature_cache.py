@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Module to keep the segment features of the audio clips
+in a content-addressed cache folder, so that the speaker
+counting scripts skip the feature extraction of the clips
+they have already seen, whatever their name or folder
+
+An entry "<key>.features.npz" holds the YIN and MFCC
+feature tables of a clip (see feature_io) with its
+duration and segment counts. Its key is a hash of the
+content of the clip and of the feature extraction
+parameters, so that changing any of them extracts the
+features again. The least recently used entries are
+evicted beyond a size limit.
+"""
+
+import os
+import hashlib
+import numpy as np
+from collections import namedtuple
+import audio_io
+import feature_io
+
+FEATURE_CACHE_SUFFIX = '.features.npz'
+
+# Number of bytes of a clip hashed at a time
+CONTENT_HASH_BLOCK = 1 << 20
+
+# Features of a clip, as returned by derive_features
+ClipFeatures = namedtuple('ClipFeatures', ['duration', 'segment_count', 'mfcc_avoided', 'gate_skipped', 'YIN',
+                                           'MFCC'])
+# Number of segment counts of ClipFeatures, stored together in a cache entry
+CLIP_COUNTS = 3
+
+
+# Content hashes of the clips already hashed in this process, or read from a clip manifest, by clip identity
+# (see clip_identity), so that a clip is only hashed once
+known_content_hashes = {}
+
+
+# Function to find the identity of an audio clip file: its absolute path, size and modification time
+def clip_identity(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+# Function to hash the content of an audio clip file
+def content_hash(path):
+    identity = clip_identity(path)
+    clip_hash = known_content_hashes.get(identity)
+    if clip_hash is None:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(CONTENT_HASH_BLOCK), b''):
+                digest.update(block)
+        clip_hash = known_content_hashes[identity] = digest.hexdigest()
+    return clip_hash
+
+
+# Function to remember the content hash 'clip_hash' of an audio clip file, known without hashing it again (e.g. from
+# a clip manifest), for content_hash
+def remember_content_hash(path, clip_hash):
+    known_content_hashes[clip_identity(path)] = clip_hash
+
+
+# Function to find the key of a clip in the feature cache from the hash of its content and the dictionary of the
+# feature extraction parameters
+def feature_cache_key(clip_hash, parameters):
+    identity = clip_hash + "|" + repr(sorted(parameters.items()))
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+
+# Function to find the file of an entry of the feature cache
+def feature_cache_file(cache_folder, key):
+    return os.path.join(cache_folder, key + FEATURE_CACHE_SUFFIX)
+
+
+# Function to look up the features of a clip in the feature cache folder 'cache_folder', numbering the segments
+# of the feature tables as those of clip 'audio_num'
+# Returns the ClipFeatures, or None if the clip is not cached; a hit marks the entry as the most recently used one
+def read_cached_features(cache_folder, key, audio_num):
+    cache_file = feature_cache_file(cache_folder, key)
+    try:
+        with np.load(cache_file) as entry:
+            tables = []
+            for name in ('YIN', 'MFCC'):
+                header = entry[name + '_header']
+                header['audio_num'] = audio_num
+                tables.append(feature_io.FeatureTable(header, entry[name + '_values']))
+            counts = entry['counts']
+            duration = float(entry['duration'])
+        os.utime(cache_file)
+    except (OSError, ValueError, KeyError):
+        return None
+    # an entry of another layout is derived again
+    if len(counts) != CLIP_COUNTS:
+        return None
+
+    return ClipFeatures(duration, *[int(count) for count in counts], *tables)
+
+
+# Function to store the ClipFeatures of a clip in the feature cache folder 'cache_folder', and to evict the least
+# recently used entries beyond 'size_limit' bytes
+# Returns the number of evicted entries
+def write_cached_features(cache_folder, key, features, size_limit):
+    os.makedirs(cache_folder, exist_ok=True)
+    cache_file = feature_cache_file(cache_folder, key)
+    # written under a temporary name first, so that a concurrent run never reads a partial entry
+    partial_file = cache_file + '.' + str(os.getpid())
+    with open(partial_file, 'wb') as f:
+        np.savez(f, YIN_header=features.YIN.header, YIN_values=features.YIN.values,
+                 MFCC_header=features.MFCC.header, MFCC_values=features.MFCC.values,
+                 counts=np.array(features[1:1 + CLIP_COUNTS], dtype=np.int64), duration=features.duration)
+    os.replace(partial_file, cache_file)
+    return evict_cached_features(cache_folder, key, size_limit)
+
+
+# Function to evict the least recently used entries of the feature cache folder 'cache_folder' beyond 'size_limit'
+# bytes, keeping the entry 'key'
+# Returns the number of evicted entries
+def evict_cached_features(cache_folder, key, size_limit):
+    return audio_io.evict_cache_files(cache_folder, FEATURE_CACHE_SUFFIX, size_limit,
+                                      feature_cache_file(cache_folder, key))
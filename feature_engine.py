@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Module to compute the YIN pitch track and the MFCCs
+of a block of equal length speech segments at once,
+following the computations of librosa.yin and
+librosa.feature.mfcc for a single segment
+"""
+
+import inspect
+import numpy as np
+import scipy.fft
+import librosa
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Padding used by librosa.stft around centered frames (zero padding since librosa 0.9, reflection before)
+STFT_PAD_MODE = inspect.signature(librosa.stft).parameters['pad_mode'].default
+
+# Parameters of librosa.power_to_db used by librosa.feature.mfcc
+POWER_AMIN = 1e-10
+POWER_TOP_DB = 80.0
+
+
+# Function to cut every row of 'segments' into centered frames, the way librosa.yin and librosa.stft do
+# Returns a read-only view of shape (segments, frames, frame_length)
+def frame_segments(segments, frame_length, hop_length, pad_mode='constant'):
+    padded = np.pad(segments, [(0, 0), (frame_length // 2, frame_length // 2)], mode=pad_mode)
+    return sliding_window_view(padded, frame_length, axis=-1)[:, ::hop_length]
+
+
+# Function to find the fraction of active frames of every segment, framed the way librosa.yin does:
+# frames whose energy (sum of the squares of their samples) reaches 'energy_lower'
+def active_frame_rate(segments, frame_length, hop_length, energy_lower):
+    frames = frame_segments(segments, frame_length, hop_length)
+    energy = np.sum(np.square(frames, dtype=np.float64), axis=-1)
+    return np.mean(energy >= energy_lower, axis=-1)
+
+
+# Function to compute the YIN autocorrelation of each frame over the lags 0 .. frame_length - win_length - 1
+def yin_autocorrelation(y_frames, frame_length, win_length):
+    a = np.fft.rfft(y_frames, frame_length, axis=-1)
+    b = np.fft.rfft(y_frames[..., win_length:0:-1], frame_length, axis=-1)
+    return np.fft.irfft(a * b, frame_length, axis=-1)[..., win_length:]
+
+
+# Function to derive the fundamental frequency of each frame from its YIN autocorrelation
+# Follows librosa.yin step by step, with the lag placed on the last axis
+def yin_from_autocorrelation(y_frames, acf_frames, sr, fmin, fmax, frame_length, win_length, trough_threshold):
+    min_period = max(int(np.floor(sr / fmax)), 1)
+    max_period = min(int(np.ceil(sr / fmin)), frame_length - win_length - 1)
+
+    acf_frames[np.abs(acf_frames) < 1e-6] = 0
+
+    # Energy terms
+    energy_frames = np.cumsum(y_frames ** 2, axis=-1)
+    energy_frames = energy_frames[..., win_length:] - energy_frames[..., :-win_length]
+    energy_frames[np.abs(energy_frames) < 1e-6] = 0
+
+    # Difference function and its cumulative mean normalization
+    yin_frames = energy_frames[..., :1] + energy_frames - 2 * acf_frames
+    yin_numerator = yin_frames[..., min_period:max_period + 1]
+    cumulative_mean = np.cumsum(yin_frames[..., 1:max_period + 1], axis=-1) / np.arange(1, max_period + 1)
+    yin_denominator = cumulative_mean[..., min_period - 1:max_period]
+    yin_frames = yin_numerator / (yin_denominator + np.finfo(yin_denominator.dtype).tiny)
+
+    # Local minima (troughs) below the absolute threshold, falling back to the global minimum
+    padded = np.pad(yin_frames, [(0, 0)] * (yin_frames.ndim - 1) + [(1, 1)], mode='edge')
+    is_trough = (yin_frames < padded[..., :-2]) & (yin_frames <= padded[..., 2:])
+    is_trough[..., 0] = yin_frames[..., 0] < yin_frames[..., 1]
+    is_threshold_trough = np.logical_and(is_trough, yin_frames < trough_threshold)
+
+    global_min = np.argmin(yin_frames, axis=-1)
+    yin_period = np.argmax(is_threshold_trough, axis=-1)
+    no_trough_below_threshold = np.all(~is_threshold_trough, axis=-1)
+    yin_period[no_trough_below_threshold] = global_min[no_trough_below_threshold]
+
+    # Refine the selected lag by parabolic interpolation over its two neighbours
+    # (only evaluated at the selected lag; a lag at either end of the search range is not shifted)
+    period = yin_period[..., None]
+    y_left = np.take_along_axis(yin_frames, np.maximum(period - 1, 0), axis=-1)[..., 0]
+    y_mid = np.take_along_axis(yin_frames, period, axis=-1)[..., 0]
+    y_right = np.take_along_axis(yin_frames, np.minimum(period + 1, yin_frames.shape[-1] - 1), axis=-1)[..., 0]
+    parabola_a = (y_left + y_right - 2 * y_mid) / 2
+    parabola_b = (y_right - y_left) / 2
+    parabolic_shift = -parabola_b / (2 * parabola_a + np.finfo(parabola_a.dtype).tiny)
+    parabolic_shift[(yin_period == 0) | (yin_period == yin_frames.shape[-1] - 1)] = 0
+    parabolic_shift[np.abs(parabolic_shift) > 1] = 0
+
+    yin_period = min_period + yin_period + parabolic_shift
+    return sr / yin_period
+
+
+# Function to compute the YIN pitch track of every segment
+# Returns an array of shape (segments, frames), equal to librosa.yin applied on each row of 'segments'
+def batch_yin(segments, sr, fmin, fmax, frame_length, win_length, hop_length, trough_threshold):
+    y_frames = frame_segments(segments, frame_length, hop_length)
+    acf_frames = yin_autocorrelation(y_frames, frame_length, win_length)
+    return yin_from_autocorrelation(y_frames, acf_frames, sr, fmin, fmax, frame_length, win_length, trough_threshold)
+
+
+# Function to turn the power spectra of the frames into log mel power spectra, as librosa.power_to_db does
+# before its top_db floor; 'power' has shape (..., frames, 1 + n_fft // 2)
+def mel_log_power(power, sr, n_fft):
+    mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft)
+    mel_power = np.einsum('...tf,mf->...tm', power, mel_basis, optimize=True)
+    return 10.0 * np.log10(np.maximum(POWER_AMIN, mel_power))
+
+
+# Function to turn the log mel power spectra of the segments into MFCCs, as librosa.feature.mfcc does
+# 'log_power' has shape (segments, frames, mels); the result has shape (segments, n_mfcc, frames)
+def mfcc_from_log_power(log_power, n_mfcc):
+    # top_db floor of librosa.power_to_db, taken separately for each segment
+    log_power = np.maximum(log_power, log_power.max(axis=(-2, -1), keepdims=True) - POWER_TOP_DB)
+
+    mfcc = scipy.fft.dct(log_power, axis=-1, type=2, norm='ortho')[..., :n_mfcc]
+    return mfcc.swapaxes(-2, -1)
+
+
+# Function to turn the power spectra of the segments into MFCCs, as librosa.feature.mfcc does
+# 'power' has shape (segments, frames, 1 + n_fft // 2); the result has shape (segments, n_mfcc, frames)
+def mfcc_from_power(power, sr, n_fft, n_mfcc):
+    return mfcc_from_log_power(mel_log_power(power, sr, n_fft), n_mfcc)
+
+
+# Function to compute the Hann analysis window of librosa.stft, centered in a frame of 'n_fft' samples
+def stft_window(n_fft, win_length):
+    window = librosa.filters.get_window('hann', win_length, fftbins=True)
+    return librosa.util.pad_center(window, size=n_fft)
+
+
+# Function to compute the MFCCs of every segment
+# Returns an array of shape (segments, n_mfcc, frames), equal to librosa.feature.mfcc applied on each row
+def batch_mfcc(segments, sr, n_fft, hop_length, win_length, n_mfcc):
+    frames = frame_segments(segments, n_fft, hop_length, STFT_PAD_MODE)
+    return mfcc_from_power(frame_power(frames, n_fft, win_length), sr, n_fft, n_mfcc)
+
+
+# Function to compute the power spectrum of every frame, windowed as librosa.stft does
+def frame_power(frames, n_fft, win_length):
+    spectrum = np.fft.rfft(stft_window(n_fft, win_length) * frames, axis=-1)
+    return np.abs(spectrum.astype(librosa.util.dtype_r2c(frames.dtype))) ** 2
+
+
+# Function to compute the YIN pitch track of a whole clip 'y', framed as a single segment, 'block_frames' frames
+# at a time; returns an array of shape (frames,)
+def clip_yin(y, sr, fmin, fmax, frame_length, win_length, hop_length, trough_threshold, block_frames):
+    y_frames = frame_segments(y[None, :], frame_length, hop_length)[0]
+    f0 = np.empty(len(y_frames))
+    for start in range(0, len(y_frames), block_frames):
+        block = y_frames[start:start + block_frames]
+        acf_frames = yin_autocorrelation(block, frame_length, win_length)
+        f0[start:start + len(block)] = yin_from_autocorrelation(block, acf_frames, sr, fmin, fmax, frame_length,
+                                                                win_length, trough_threshold)
+    return f0
+
+
+# Function to compute the log mel power spectrum (see mel_log_power) of every frame of a whole clip 'y', framed
+# as a single segment, 'block_frames' frames at a time; returns an array of shape (frames, mels)
+# The MFCCs of any run of frames follow from mfcc_from_log_power
+def clip_mel_log_power(y, sr, n_fft, hop_length, win_length, block_frames):
+    frames = frame_segments(y[None, :], n_fft, hop_length, STFT_PAD_MODE)[0]
+    blocks = [mel_log_power(frame_power(frames[start:start + block_frames], n_fft, win_length), sr, n_fft)
+              for start in range(0, len(frames), block_frames)]
+    return np.concatenate(blocks) if len(blocks) > 0 else np.zeros((0, 0))
+
+
+# Function to compute both the YIN pitch track and the MFCCs of every segment from a single framing pass
+# Returns the same arrays as batch_yin and batch_mfcc with n_fft == frame_length, within single precision
+#
+# Each frame gets one real FFT, shared by the YIN autocorrelation. The two short windows of the frame,
+# its YIN lag window y[1 .. win_length] and its Hann windowed centre for the MFCC, only hold 'win_length'
+# samples each, so they share one complex FFT (real and imaginary part) and are told apart by conjugate
+# symmetry. The autocorrelation is the cross-correlation of the frame with its lag window, and the
+# windowed spectrum gives the mel power spectrum. The transforms run in single precision.
+def fused_features(segments, sr, fmin, fmax, frame_length, win_length, hop_length, trough_threshold, n_mfcc):
+    n = frame_length
+    n_bins = 1 + n // 2
+    y_frames = frame_segments(segments, n, hop_length)
+    stft_frames = y_frames if STFT_PAD_MODE == 'constant' else frame_segments(segments, n, hop_length, STFT_PAD_MODE)
+
+    frame_spectra = scipy.fft.rfft(y_frames, axis=-1)
+
+    window = librosa.filters.get_window('hann', win_length, fftbins=True).astype(np.float32)
+    window_start = (n - win_length) // 2
+    short_windows = np.zeros(y_frames.shape, dtype=np.complex64)
+    short_windows.real[..., 1:win_length + 1] = y_frames[..., 1:win_length + 1]
+    short_windows.imag[..., :win_length] = window * stft_frames[..., window_start:window_start + win_length]
+    short_spectra = scipy.fft.fft(short_windows, axis=-1)
+    mirrored = np.conj(np.concatenate([short_spectra[..., :1], short_spectra[..., :n // 2 - 1:-1]], axis=-1))
+    short_spectra = short_spectra[..., :n_bins]
+    lag_spectra = short_spectra + mirrored  # twice the lag window spectrum
+    windowed_spectra = short_spectra - mirrored  # 2j times the windowed spectrum
+
+    frame_spectra *= np.conj(lag_spectra)
+    acf_frames = scipy.fft.irfft(frame_spectra, n, axis=-1)[..., :n - win_length].astype(np.float64) / 2
+    f0 = yin_from_autocorrelation(y_frames, acf_frames, sr, fmin, fmax, frame_length, win_length, trough_threshold)
+
+    power = (windowed_spectra.real ** 2 + windowed_spectra.imag ** 2) / 4
+    return f0, mfcc_from_power(power, sr, n, n_mfcc)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Module to store the per-segment feature lists of the
+speaker counting scripts (YIN, MFCC, rev.MFCC, merged.MFCC
+and new.MFCC) in binary files instead of text files.
+
+A feature file "NAME.npy" holds the feature values of all
+the segments, one after the other, as a float32 block, and
+"NAME.header.npy" holds one fixed-width record per segment:
+its header fields (audio and segment numbers, and for the
+voiced segments their pitch and frame count) followed by
+the offset and the number of its values in the block.
+Both are standard .npy files, memory-mapped when loaded.
+The merged segments and the admitted speakers (merged.MFCC
+and new.MFCC) hold the column sums of their MFCC matrices
+instead of the MFCC frames, as a float64 block.
+The speaker counting scripts also hold the segments of
+every stage in memory as such FeatureTables, and pass
+them between processes through shared memory blocks.
+"""
+
+import os
+import numpy as np
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+# Header fields of the segment feature lists (YIN, MFCC)
+SEGMENT_FIELDS = ('audio_num', 'segment_num')
+# Header fields of the voiced segment feature lists (rev.MFCC, merged.MFCC, new.MFCC)
+VOICED_SEGMENT_FIELDS = ('audio_num', 'segment_num', 'pitch', 'frame_count')
+# Header fields of the frame level feature lists, one row per audio clip (frames.YIN, frames.MEL): the duration
+# of the clip, and the rate and the hop length at which its frames were analysed
+CLIP_FRAME_FIELDS = ('audio_num', 'duration', 'sample_rate', 'hop_length')
+
+FIELD_TYPES = {
+    'audio_num': np.int32,
+    'segment_num': np.int32,
+    'pitch': np.float64,
+    'frame_count': np.int64,
+    'duration': np.float64,
+    'sample_rate': np.int64,
+    'hop_length': np.int64,
+    'offset': np.int64,
+    'length': np.int64,
+}
+
+VALUE_TYPE = np.float32
+# Type of the MFCC column sums of the merged segments and the admitted speakers
+SUM_TYPE = np.float64
+HEADER_SUFFIX = '.header.npy'
+
+# Feature list held as arrays: one header record per segment and the block of all the feature values (VALUE_TYPE,
+# or SUM_TYPE for the column sums of merged segments and admitted speakers)
+FeatureTable = namedtuple('FeatureTable', ['header', 'values'])
+
+# Array passed to another process without pickling its content: held in the shared memory block 'name', or
+# memory-mapped from the file 'name' at 'offset'
+SharedArray = namedtuple('SharedArray', ['name', 'offset', 'shape', 'dtype', 'mapped'])
+
+
+# Function to find the header file of a feature file
+def header_file(feature_file):
+    return os.path.splitext(feature_file)[0] + HEADER_SUFFIX
+
+
+# Function to find the legacy text file of a feature file
+def text_file(feature_file):
+    return os.path.splitext(feature_file)[0] + '.txt'
+
+
+# Function to find the type of the header records of a feature table with the header 'fields'
+def header_type(fields):
+    return [(name, FIELD_TYPES[name]) for name in fields + ('offset', 'length')]
+
+
+# Function to turn a list of feature tuples, each made of the header 'fields' followed by the feature values,
+# into a FeatureTable whose values are of type 'value_type'
+def feature_table(feature_List, fields, value_type=VALUE_TYPE):
+    n_fields = len(fields)
+    header = np.zeros(len(feature_List), dtype=header_type(fields))
+    offset = 0
+    for i, x in enumerate(feature_List):
+        header[i] = tuple(x[:n_fields]) + (offset, len(x) - n_fields)
+        offset += len(x) - n_fields
+
+    values = np.empty(offset, dtype=value_type)
+    for x, row in zip(feature_List, header):
+        values[row['offset']:row['offset'] + row['length']] = x[n_fields:]
+
+    return FeatureTable(header, values)
+
+
+# Function to build a FeatureTable from the columns of its header 'fields' (one array or list per field, in the
+# order of 'fields') and the feature values of its segments (one 1-D array per segment)
+def segment_table(columns, rows, fields, value_type=VALUE_TYPE):
+    header = np.zeros(len(rows), dtype=header_type(fields))
+    for name, column in zip(fields, columns):
+        header[name] = column
+    header['length'] = [len(x) for x in rows]
+    header['offset'] = np.cumsum(header['length']) - header['length']
+
+    values = np.concatenate(rows).astype(value_type, copy=False) if len(rows) > 0 else np.zeros(0, dtype=value_type)
+    return FeatureTable(header, values)
+
+
+# Function to build a FeatureTable of segments holding the same number of feature values from the columns of its
+# header 'fields' and the (segments, values) matrix of their feature values
+def matrix_table(columns, matrix, fields, value_type=VALUE_TYPE):
+    matrix = np.asarray(matrix)
+    header = np.zeros(len(matrix), dtype=header_type(fields))
+    for name, column in zip(fields, columns):
+        header[name] = column
+    header['length'] = matrix.shape[1] if matrix.ndim == 2 else 0
+    header['offset'] = np.arange(len(matrix)) * header['length']
+    return FeatureTable(header, matrix.astype(value_type, copy=False).ravel())
+
+
+# Function to join FeatureTables with the same header fields, one after the other
+def concatenate_tables(tables, fields, value_type=VALUE_TYPE):
+    if len(tables) == 0:
+        return FeatureTable(np.zeros(0, dtype=header_type(fields)), np.zeros(0, dtype=value_type))
+
+    header = np.concatenate([table.header for table in tables])
+    offsets = np.cumsum([0] + [len(table.values) for table in tables[:-1]])
+    header['offset'] += np.repeat(offsets, [len(table.header) for table in tables])
+    values = np.concatenate([np.asarray(table.values, dtype=value_type) for table in tables])
+    return FeatureTable(header, values)
+
+
+# Function to write a list of feature tuples, each made of the header 'fields' followed by the feature values
+# With 'export_text', the list is also written as a legacy text file, one comma separated tuple per line
+def write_feature_file(feature_List, output_file, fields, export_text=False, value_type=VALUE_TYPE):
+    write_feature_table(feature_table(feature_List, fields, value_type), output_file)
+
+    if export_text:
+        with open(text_file(output_file), 'w') as f:
+            for x in feature_List:
+                print(str(x)[1:-1], file=f)
+
+
+# Function to write a FeatureTable, its values converted to 'value_type' if given
+# With 'export_text', the table is also written as a legacy text file, one comma separated tuple per line
+def write_feature_table(table, output_file, export_text=False, value_type=None):
+    if value_type is not None:
+        table = FeatureTable(table.header, np.asarray(table.values, dtype=value_type))
+    np.save(header_file(output_file), table.header)
+    np.save(output_file, table.values)
+
+    if export_text:
+        with open(text_file(output_file), 'w') as f:
+            for x in table_rows(table):
+                print(str(x)[1:-1], file=f)
+
+
+# Function to load a feature file written by write_feature_file as a FeatureTable, memory-mapping its arrays
+def read_feature_file(input_file):
+    header = np.load(header_file(input_file), mmap_mode='r')
+    if len(header) == 0 or header[-1]['offset'] + header[-1]['length'] == 0:
+        return FeatureTable(header, np.zeros(0, dtype=VALUE_TYPE))
+    return FeatureTable(header, np.load(input_file, mmap_mode='r'))
+
+
+# Function to gather the feature values of the rows 'start' to 'stop' of a FeatureTable as a (rows, values)
+# matrix, padding the shorter rows with NaN
+# Returns the matrix, a view of the table values if all the rows have the same length, and the row lengths
+def feature_matrix(table, start=0, stop=None):
+    header = table.header[start:stop]
+    lengths = np.asarray(header['length'])
+    if len(header) == 0:
+        return np.zeros((0, 0), dtype=table.values.dtype), lengths
+
+    first = int(header[0]['offset'])
+    last = int(header[-1]['offset'] + header[-1]['length'])
+    width = int(lengths.max())
+    if np.all(lengths == width):
+        return table.values[first:last].reshape(len(header), width), lengths
+
+    matrix = np.full((len(header), width), np.nan, dtype=table.values.dtype)
+    matrix[np.arange(width) < lengths[:, None]] = table.values[first:last]
+    return matrix, lengths
+
+
+# Function to list the rows of a FeatureTable one by one, as tuples of their header fields and feature values
+def table_rows(table):
+    header, values = table
+    for row in header:
+        fields = row.item()
+        offset, length = fields[-2:]
+        yield fields[:-2] + tuple(values[offset:offset + length].tolist())
+
+
+# Function to read the feature tuples of a feature file one by one, as they were written
+def feature_rows(input_file):
+    return table_rows(read_feature_file(input_file))
+
+
+# Function to share an array with other processes: a memory-mapped array by its file, any other array by copying
+# it into a new shared memory block, which the process reading it back unlinks (see read_shared_array)
+# A memory-mapped array must map its whole file region, not be a slice of a larger mapping
+def share_array(array):
+    if isinstance(array, np.memmap) and array.filename is not None and array.flags['C_CONTIGUOUS']:
+        return SharedArray(array.filename, array.offset, array.shape, array.dtype, True)
+
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=block.buf)[...] = array
+    block.close()
+    return SharedArray(block.name, 0, array.shape, array.dtype, False)
+
+
+# Function to attach an array shared by share_array, without copying it
+# Returns the array and the shared memory block backing it (None for a memory-mapped array), to be closed once
+# the array is no longer used
+def attach_shared_array(shared):
+    if shared.mapped:
+        return np.memmap(shared.name, dtype=shared.dtype, mode='r', offset=shared.offset, shape=shared.shape), None
+    block = shared_memory.SharedMemory(name=shared.name)
+    return np.ndarray(shared.shape, shared.dtype, buffer=block.buf), block
+
+
+# Function to copy an array shared by share_array into this process, and to release its shared memory block
+def read_shared_array(shared):
+    array, block = attach_shared_array(shared)
+    array = np.array(array)
+    release_shared_array(shared, block)
+    return array
+
+
+# Function to close the shared memory block of an array shared by share_array, and to unlink it
+def release_shared_array(shared, block=None):
+    if shared.mapped:
+        return
+    if block is None:
+        block = shared_memory.SharedMemory(name=shared.name)
+    block.close()
+    block.unlink()
+
+
+# Function to share a FeatureTable with other processes (see share_array)
+def share_feature_table(table):
+    return FeatureTable(share_array(table.header), share_array(table.values))
+
+
+# Function to copy a FeatureTable shared by share_feature_table into this process, releasing its shared memory
+def read_shared_feature_table(shared_table):
+    return FeatureTable(read_shared_array(shared_table.header), read_shared_array(shared_table.values))
@@ -14,11 +14,11 @@ Created on Sun July 22 01:04:57 2021
 
 import os
 import sys
+import argparse
 from time import process_time
 import librosa
 import unsupervised_speaker_count as usc
-import csv
-import numpy as np
+import feature_io
 from statistics import mean
 
 # Move the control to Current Working Directory
@@ -26,48 +26,11 @@ path = os.getcwd()
 # print("\nLocation of the current python script:", path)
 os.chdir(path)
 
-# Find Total number of arguments passed to the script
-n = len(sys.argv)
-
-if n < 3:
-    print("\nPut test conversation in a folder and pass the folder path as first command line argument")
-    print("\nPut target speech signature in another folder and pass the folder path as second command line argument")
-    exit(1)
-
-# Input Audio Details
-speech_folder_name = sys.argv[1]
-calibration_folder_name = sys.argv[2]
-
-if os.path.exists(speech_folder_name) is False:
-    sys.exit("\nFolder \"" + speech_folder_name + "\" not found. Check the speech folder path")
-
-if os.path.exists(calibration_folder_name) is False:
-    sys.exit("\nFolder \"" + calibration_folder_name + "\" not found. Check the calibration folder path")
-
 # tuple of supported audio file extensions
 file_extension = ('.mp3', '.wav')
 
 # Temporary intermediate files
 temporary_directory = "temp"
-tmp_tst_dir_path = os.path.join(speech_folder_name, temporary_directory)
-tmp_cal_dir_path = os.path.join(calibration_folder_name, temporary_directory)
-
-if os.path.exists(tmp_tst_dir_path) is False:
-    os.makedirs(tmp_tst_dir_path)
-
-if os.path.exists(tmp_cal_dir_path) is False:
-    os.makedirs(tmp_cal_dir_path)
-
-output_file_extension = ".txt"
-tst_yin_file = speech_folder_name + '/temp/YIN' + output_file_extension
-tst_mfcc_file = speech_folder_name + '/temp/MFCC' + output_file_extension
-cal_yin_file = calibration_folder_name + '/temp/YIN' + output_file_extension
-cal_mfcc_file = calibration_folder_name + '/temp/MFCC' + output_file_extension
-rev_mfcc_file = speech_folder_name + '/temp/rev.MFCC' + output_file_extension
-merged_mfcc_file = speech_folder_name + '/temp/merged.MFCC' + output_file_extension
-rev_cal_mfcc_file = calibration_folder_name + '/temp/rev.MFCC' + output_file_extension
-merged_cal_mfcc_file = calibration_folder_name + '/temp/merged.MFCC' + output_file_extension
-new_mfcc_file = speech_folder_name + '/temp/new.MFCC' + output_file_extension
 
 # Assumed Sampling Rate
 # sampling_rate = 22050
@@ -107,35 +70,10 @@ trough_threshold = usc.trough_threshold
 n_fft = usc.n_fft
 n_mfcc = usc.n_mfcc
 
-# Suppress repeated "PySoundFile failed. Trying audioread instead." warning by Librosa
-if not sys.warnoptions:
-    import warnings
-    warnings.simplefilter("ignore")
-
 
 def cal_merge_segments(revised_ceptral_file, merged_ceptral_file):
-    MFCC_List = []
-    pitch_List = []
-
-    with open(revised_ceptral_file, "r") as f:
-        csv_reader = csv.reader(f, delimiter=',')
-
-        mfcc_line_count = 0
-
-        for row in csv_reader:
-            curr_audio_num = int(row[0])
-            curr_segment_num = int(row[1])
-            curr_segment_pitch = float(row[2])
-            curr_segment_frame_count = int(row[3])
-            segment_mfcc_str = np.array(row[4:])
-            segment_mfcc = segment_mfcc_str.astype(float)
-
-            MFCC_List.append(
-                (curr_audio_num, curr_segment_num, curr_segment_pitch, curr_segment_frame_count) + tuple(segment_mfcc))
-            pitch_List.append(curr_segment_pitch)
-            mfcc_line_count += 1
-
-    f.close()
+    MFCC_List = [usc.segment_statistics(row) for row in feature_io.feature_rows(revised_ceptral_file)]
+    pitch_List = [row[2] for row in MFCC_List]
 
     segment_pitch_mean = mean(pitch_List)
 
@@ -164,7 +102,7 @@ def cal_merge_segments(revised_ceptral_file, merged_ceptral_file):
             # revised_segment_num_p = segment_num_p
             # revised_segment_pitch_p = (segment_pitch_p + segment_pitch_q) / 2
             revised_segment_frame_count_p = segment_frame_count_p + segment_frame_count_q
-            revised_mfcc_p = mfcc_p + mfcc_q
+            revised_mfcc_p = usc.add_statistics(mfcc_p, mfcc_q)
 
             revised_item_p = (audio_num_p, segment_num_p, segment_pitch_p,
                               revised_segment_frame_count_p) + tuple(revised_mfcc_p)
@@ -183,17 +121,15 @@ def cal_merge_segments(revised_ceptral_file, merged_ceptral_file):
     revised_mfcc_tuple = (0, 1) + (segment_pitch_mean,) + mfcc_tuple[3:]
     MFCC_List.append(revised_mfcc_tuple)
 
-    usc.file_write(MFCC_List, merged_ceptral_file)
+    usc.feature_write(MFCC_List, merged_ceptral_file, feature_io.VOICED_SEGMENT_FIELDS, feature_io.SUM_TYPE)
     # print("Size of Segment List after merging Matching Segments:", last_size, "\n")
     return MFCC_List
 
 
 def self_calibration(cal_dir, audio_ext, cal_pitch_file, cal_cept_file, rev_cal_cept_file, merged_cal_cept_file):
-    num_cal_segments, segment_frame_count = \
-        usc.Generate_Feature_Files(cal_dir, audio_ext, cal_pitch_file, cal_cept_file)
+    num_cal_segments = usc.Generate_Feature_Files(cal_dir, audio_ext, cal_pitch_file, cal_cept_file)
     # Remove non-voiced audio segments from the list using generated Pitch and MFCC features
-    num_cal_voiced_segments = \
-        usc.Remove_Non_Voiced(cal_pitch_file, cal_cept_file, segment_frame_count, rev_cal_cept_file)
+    num_cal_voiced_segments = usc.Remove_Non_Voiced(cal_pitch_file, cal_cept_file, rev_cal_cept_file)
     print("Owner Speech Segments:", num_cal_segments, "Owner Voiced Segments:", num_cal_voiced_segments)
 
     if num_cal_voiced_segments * SEGMENT_LENGTH < CAL_DURATION_SEC_LOWER:
@@ -207,43 +143,17 @@ def self_calibration(cal_dir, audio_ext, cal_pitch_file, cal_cept_file, rev_cal_
     return True
 
 
-def semisupervised_speaker_counting(tst_cept_file, trn_cept_file):
+def semisupervised_speaker_counting(tst_cept_file, trn_cept_file, new_cept_file):
     trn_feature_list = []
     tst_feature_list = []
     new_feature_list = []
     owner_presence_status = True
 
     # Extract the training speech features in the training feature list
-    with open(trn_cept_file, "r") as f:
-        csv_reader = csv.reader(f, delimiter=',')
-        line_count = 0
-        for row in csv_reader:
-            curr_audio_num = int(row[0])
-            curr_segment_num = int(row[1])
-            curr_segment_pitch = float(row[2])
-            curr_segment_frame_count = int(row[3])
-            segment_mfcc_str = np.array(row[4:])
-            segment_mfcc = segment_mfcc_str.astype(float)
-            trn_feature_list.append(
-                (curr_audio_num, curr_segment_num, curr_segment_pitch, curr_segment_frame_count) + tuple(segment_mfcc))
-            line_count += 1
-    f.close()
+    trn_feature_list.extend(feature_io.feature_rows(trn_cept_file))
 
     # Extract the test audio features in the test feature list
-    with open(tst_cept_file, "r") as f:
-        csv_reader = csv.reader(f, delimiter=',')
-        line_count = 0
-        for row in csv_reader:
-            curr_audio_num = int(row[0])
-            curr_segment_num = int(row[1])
-            curr_segment_pitch = float(row[2])
-            curr_segment_frame_count = int(row[3])
-            segment_mfcc_str = np.array(row[4:])
-            segment_mfcc = segment_mfcc_str.astype(float)
-            tst_feature_list.append(
-                (curr_audio_num, curr_segment_num, curr_segment_pitch, curr_segment_frame_count) + tuple(segment_mfcc))
-            line_count += 1
-    f.close()
+    tst_feature_list.extend(feature_io.feature_rows(tst_cept_file))
 
     trn_feature_list_size = len(trn_feature_list)
     tst_feature_list_size = len(tst_feature_list)
@@ -281,7 +191,7 @@ def semisupervised_speaker_counting(tst_cept_file, trn_cept_file):
             # new_segment_num = new_feature_list[j][1]
 
             new_pitch = new_feature_list[j][2]
-            # new_frame_count = new_feature_list[j][3]
+            new_frame_count = new_feature_list[j][3]
             new_mfcc = new_feature_list[j][4:]
 
             # pitch = tst_feature_list[i][2]
@@ -289,7 +199,8 @@ def semisupervised_speaker_counting(tst_cept_file, trn_cept_file):
             # mfcc = tst_feature_list[i][4:]
 
             decision = usc.gender_decision(new_pitch, pitch)
-            distance = usc.get_Distance(new_mfcc, mfcc)
+            distance = usc.get_Distance(usc.get_column_mean(new_mfcc, new_frame_count),
+                                        usc.get_column_mean(mfcc, frame_count))
 
             print("i =", i, "j =", j, "New length:", new_feature_list[0][3], "length:", length, "Decision:", decision,
                   "Distance:", distance, "Diff Count:", diff_count, "Current Speaker Count:", speaker_count)
@@ -343,7 +254,7 @@ def semisupervised_speaker_counting(tst_cept_file, trn_cept_file):
                 # new_pitch = (new_pitch + pitch) / 2
                 new_pitch = (new_pitch * new_frame_count + pitch * frame_count) / (new_frame_count + frame_count)
                 new_frame_count = new_frame_count + frame_count
-                new_mfcc = new_mfcc + mfcc
+                new_mfcc = usc.add_statistics(new_mfcc, mfcc)
 
                 new_item = (new_audio_num, new_segment_num, new_pitch, new_frame_count) + tuple(new_mfcc)
                 new_feature_list[j_best_match] = new_item
@@ -364,13 +275,14 @@ def semisupervised_speaker_counting(tst_cept_file, trn_cept_file):
     owner_speech_percentage = 100 * (new_feature_list[0][3] - trn_feature_list[0][3]) / length
 
     # Store new feature list in a file
-    usc.file_write(new_feature_list, new_mfcc_file)
+    usc.feature_write(new_feature_list, new_cept_file, feature_io.VOICED_SEGMENT_FIELDS, feature_io.SUM_TYPE)
 
     return speaker_count, owner_presence_status, owner_speech_percentage
 
 
 def count_speaker_semi(speech_dir, cal_dir, audio_ext, tst_pitch_file, tst_cept_file, cal_pitch_file,
-                       cal_cept_file, rev_cept_file, rev_cal_cept_file, merged_cept_file, merged_cal_cept_file):
+                       cal_cept_file, rev_cept_file, rev_cal_cept_file, merged_cept_file, merged_cal_cept_file,
+                       new_cept_file):
     # Initialize
     speaker_count = 0
     owner_presence_status = False
@@ -379,19 +291,18 @@ def count_speaker_semi(speech_dir, cal_dir, audio_ext, tst_pitch_file, tst_cept_
     # Split each audio file (having supported extension) in speech folder into segments (of equal duration)
     # Generate Pitch and MFCC features for each segment
     # and save these feature vectors/matrices in corresponding feature files for further processing
-    num_tst_segments, segment_frame_count = \
-        usc.Generate_Feature_Files(speech_dir, audio_ext, tst_pitch_file, tst_cept_file)
+    num_tst_segments = usc.Generate_Feature_Files(speech_dir, audio_ext, tst_pitch_file, tst_cept_file)
 
     # Remove non-voiced audio segments from the list using generated Pitch and MFCC features
-    num_voiced_segments = usc.Remove_Non_Voiced(tst_pitch_file, tst_cept_file, segment_frame_count, rev_cept_file)
+    num_voiced_segments = usc.Remove_Non_Voiced(tst_pitch_file, tst_cept_file, rev_cept_file)
     print("Total Test Segments:", num_tst_segments, "Voiced Test Segments:", num_voiced_segments)
 
     if num_voiced_segments == 0:
         print("No test voiced segment in Speech Folder")
         return speaker_count, owner_presence_status, owner_speech_percentage
     else:
-        mfcc_list = usc.merge_segments(rev_cept_file, merged_cept_file)
-        mfcc_list_size = len(mfcc_list)
+        mfcc_table = usc.merge_segments(rev_cept_file, merged_cept_file)
+        mfcc_list_size = len(mfcc_table.header)
         print("MFCC List Size:", mfcc_list_size)
 
     calibration = self_calibration(cal_dir, audio_ext, cal_pitch_file,
@@ -401,16 +312,66 @@ def count_speaker_semi(speech_dir, cal_dir, audio_ext, tst_pitch_file, tst_cept_
         print("Calibration Failed due to insufficient owner voice sample")
         return speaker_count, owner_presence_status, owner_speech_percentage
 
-    return semisupervised_speaker_counting(merged_cept_file, merged_cal_cept_file)
+    return semisupervised_speaker_counting(merged_cept_file, merged_cal_cept_file, new_cept_file)
 
 
 # Call the main function
 def main_function():
+    parser = argparse.ArgumentParser(
+        description="Count the speakers of a test conversation, and the presence of the owner of a speech signature")
+    parser.add_argument("speech_folder", nargs="?", help="folder of the test conversation")
+    parser.add_argument("calibration_folder", nargs="?", help="folder of the target speech signature")
+    usc.add_options(parser)
+    arguments = parser.parse_args()
+    try:
+        usc.configure(**usc.parsed_options(arguments))
+    except ValueError as error:
+        parser.error(str(error))
+    # the segment length follows the options of unsupervised_speaker_count
+    global SEGMENT_LENGTH
+    SEGMENT_LENGTH = usc.SEGMENT_LENGTH
+
+    if arguments.calibration_folder is None:
+        print("\nPut test conversation in a folder and pass the folder path as first command line argument")
+        print("\nPut target speech signature in another folder and pass the folder path as second command line "
+              "argument")
+        exit(1)
+
+    # Input Audio Details
+    speech_folder_name = arguments.speech_folder
+    calibration_folder_name = arguments.calibration_folder
+
+    if os.path.exists(speech_folder_name) is False:
+        sys.exit("\nFolder \"" + speech_folder_name + "\" not found. Check the speech folder path")
+
+    if os.path.exists(calibration_folder_name) is False:
+        sys.exit("\nFolder \"" + calibration_folder_name + "\" not found. Check the calibration folder path")
+
+    tmp_tst_dir_path = os.path.join(speech_folder_name, temporary_directory)
+    tmp_cal_dir_path = os.path.join(calibration_folder_name, temporary_directory)
+
+    if os.path.exists(tmp_tst_dir_path) is False:
+        os.makedirs(tmp_tst_dir_path)
+
+    if os.path.exists(tmp_cal_dir_path) is False:
+        os.makedirs(tmp_cal_dir_path)
+
+    feature_file_extension = usc.feature_file_extension
+    tst_yin_file = speech_folder_name + '/temp/YIN' + feature_file_extension
+    tst_mfcc_file = speech_folder_name + '/temp/MFCC' + feature_file_extension
+    cal_yin_file = calibration_folder_name + '/temp/YIN' + feature_file_extension
+    cal_mfcc_file = calibration_folder_name + '/temp/MFCC' + feature_file_extension
+    rev_mfcc_file = speech_folder_name + '/temp/rev.MFCC' + feature_file_extension
+    merged_mfcc_file = speech_folder_name + '/temp/merged.MFCC' + feature_file_extension
+    rev_cal_mfcc_file = calibration_folder_name + '/temp/rev.MFCC' + feature_file_extension
+    merged_cal_mfcc_file = calibration_folder_name + '/temp/merged.MFCC' + feature_file_extension
+    new_mfcc_file = speech_folder_name + '/temp/new.MFCC' + feature_file_extension
+
     start = process_time()
     final_speaker_count, owner_status, owner_speech_percentage = \
         count_speaker_semi(speech_folder_name, calibration_folder_name, file_extension,
                            tst_yin_file, tst_mfcc_file, cal_yin_file, cal_mfcc_file,
-                           rev_mfcc_file, rev_cal_mfcc_file, merged_mfcc_file, merged_cal_mfcc_file)
+                           rev_mfcc_file, rev_cal_mfcc_file, merged_mfcc_file, merged_cal_mfcc_file, new_mfcc_file)
     end = process_time()
     print(final_speaker_count, "number of different speakers identified in all the audio clips of the input folder")
     if owner_status is False:
@@ -418,6 +379,7 @@ def main_function():
     else:
         print("Owner Contribution in Test Conversation:", str(round(owner_speech_percentage,2)) + "%")
     print("Time elapsed during the computation:", end - start, "seconds")
+    usc.report_decoders()
 
 
 # Using the special variable __name__
@@ -12,64 +12,111 @@ Created on Sun May 30 01:04:57 2021
 
 import os
 import sys
+import argparse
 import numpy as np
 import librosa
 import librosa.display
 import statistics
-from numpy import linalg as la
-import csv
 import math
 from time import process_time
+from time import perf_counter
+import queue
+import threading
+from collections import deque
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import resource_tracker
+import audio_io
+import clip_manifest
+import cluster_engine
+import feature_cache
+import feature_engine
+import feature_io
 
 # Move the control to Current Working Directory
 path = os.getcwd()
 # print("\nLocation of the current python script:", path)
 os.chdir(path)
 
-# Find Total number of arguments passed to the script
-n = len(sys.argv)
-# print("\nTotal number of arguments passed:", n)
 
-# List the arguments passed
-# print("\nName of Python script:", sys.argv[0])
+# Feature backend: "librosa" (one librosa call per segment), "batched" (vectorized over blocks of segments)
+# or "fused" (vectorized, with pitch and cepstral features sharing the framing and the FFTs of each frame)
+FEATURE_BACKENDS = ("librosa", "batched", "fused")
+feature_backend = "librosa"
 
-# print("\nArguments passed:", end=" ")
-# for i in range(1, n):
-#     print(sys.argv[i], end=" ")
-# print()
+# Compare the selected feature backend with the librosa backend on every clip, instead of counting speakers
+check_features = False
 
-if n < 2:
-    exit("\nPlease include recorded clips in a directory and\n" + "pass the directory path as command line argument")
+# Stream the segments through feature extraction, voiced filtering, neighbor merging and speaker admission,
+# without the intermediate feature files, keeping only a small window of segments in memory
+streaming = False
 
-# Input Audio Details
-speech_folder_name = sys.argv[1]
+# Audio decoder: "auto" (memory-mapped WAV, then the in-process soundfile decoder, then audioread as a slow
+# fallback), "soundfile" or "audioread"
+DECODERS = ("auto", "soundfile", "audioread")
+decoder = "auto"
 
-if os.path.exists(speech_folder_name) is False:
-    sys.exit("\nFolder \"" + speech_folder_name + "\" not found. Check the Speech folder path")
+# Also write every binary feature file as a legacy text file (same name, ".txt" extension) for debugging
+export_text = False
+
+# Skip the pitch and cepstral analysis of digitally silent segments, which can never be voiced
+energy_gate = False
+
+# Precompute the angles and the gender decisions of all the voiced segment pairs before merging, in blocks fitting
+# in the given memory budget (in megabytes), and keep them in the "temp" folder (angle.npy and gender.npy)
+angle_matrix_budget = None
+
+# Keep the decoded clips in a PCM cache folder, memory-mapped by later runs instead of decoding the clips again,
+# holding at most "--pcm-cache-size" megabytes (the least recently used clips are evicted)
+pcm_cache_folder = None
+pcm_cache_size = 4096.0
+
+# Keep the segment features of the clips in a feature cache folder, keyed by the content of each clip and the
+# feature extraction parameters, holding at most "--feature-cache-size" megabytes (least recently used evicted)
+feature_cache_folder = None
+feature_cache_size = 4096.0
+
+# Keep a manifest of the clips of the speech folder with their features (in the "incremental" folder), so that
+# a run only extracts the features of the clips added or modified since the previous run
+incremental = False
+
+# Number of worker processes extracting the features of the clips in parallel, one clip at a time
+jobs = 1
+
+# Number of chunks, cut at segment boundaries, whose features are extracted in parallel worker processes for each
+# clip, for long single recordings
+clip_chunks = 1
+
+# Decode the upcoming clips in a background thread, at most "--prefetch" clips ahead of the feature extraction
+prefetch_depth = 0
+
+# Keep the pitch and the log mel power of every frame of the clips in the "temp" folder (frames.YIN.npy and
+# frames.MEL.npy), and cut the segments from them, so that another segment length needs no feature extraction
+frame_store = False
 
 # tuple of supported audio file extensions
 file_extension = ('.mp3', '.wav')
 
 # Temporary intermediate files
 temporary_directory = "temp"
-temporary_directory_path = os.path.join(speech_folder_name, temporary_directory)
 
-if os.path.exists(temporary_directory_path) is False:
-    os.makedirs(temporary_directory_path)
+# Manifest of the clips of the speech folder and their features, kept across incremental runs
+incremental_directory = "incremental"
 
 output_file_extension = ".txt"
-yin_file = speech_folder_name + '/temp/YIN' + output_file_extension
-mfcc_file = speech_folder_name + '/temp/MFCC' + output_file_extension
-# metadata_file = speech_folder_name + '/temp/MetaData' + output_file_extension
-
-rev_mfcc_file = speech_folder_name + '/temp/rev.MFCC' + output_file_extension
-
-merged_mfcc_file = speech_folder_name + '/temp/merged.MFCC' + output_file_extension
-new_mfcc_file = speech_folder_name + '/temp/new.MFCC' + output_file_extension
+# Binary feature files (see feature_io), also exported as legacy text files with "--export-text"
+feature_file_extension = ".npy"
 
 # Assumed Sampling Rate
 sample_rate = 44100
 
+# Multi-rate analysis: the clips are analysed at 'analysis_rate' (None keeps the native rate of each clip)
+# and, unless 'yin_rate' is 0, YIN runs on the segments decimated to 'yin_rate' within the human pitch range
+analysis_rate = sample_rate
+yin_rate = 0
+
 # Application Parameters: Adopted from crowdpp Android Implementation
 SEGMENT_LENGTH = 3.0  # measured in second
 
@@ -87,11 +134,6 @@ PITCH_SIGMA_UPPER = 100  # measured in Hertz
 MFCC_DIST_SAME_UN = 14
 MFCC_DIST_DIFF_UN = 28
 
-# Set Tuning Parameters using command line arguments to the script
-if n > 3:
-    MFCC_DIST_SAME_UN = float(sys.argv[2])
-    MFCC_DIST_DIFF_UN = float(sys.argv[3])
-
 # YIN Pitch Detection Method Parameters
 frame_length = 512
 hop_length = frame_length // 4
@@ -105,11 +147,163 @@ trough_threshold = 0.1
 n_fft = frame_length
 n_mfcc = 20
 
-# Suppress repeated "PySoundFile failed. Trying audioread instead." warning by Librosa
+# Number of segments stacked together by the batched and fused feature backends
+BATCH_SEGMENTS = 8
+
+# Tolerances of the feature backends with respect to the per-segment librosa computation
+PITCH_RELATIVE_TOLERANCE = 1e-4  # relative deviation allowed for the pitch of a YIN frame
+PITCH_MISMATCH_RATE = 1e-3  # fraction of YIN frames allowed to exceed the pitch tolerance
+MFCC_ABSOLUTE_TOLERANCE = 1e-2  # deviation allowed for an MFCC coefficient
+VOICED_MISMATCH_RATE = 0.05  # fraction of segments allowed to change their voiced decision (multi-rate analysis)
+
+# Number of segments whose pitch tracks are stacked together when selecting the voiced segments, and relative
+# distance to a voicing threshold below which a segment is decided with the exact statistics module
+VOICING_BLOCK = 4096
+VOICING_TOLERANCE = 1e-9
+
+# Bytes of working memory needed per voiced segment pair while computing a block of the angle matrix
+ANGLE_MATRIX_PAIR_BYTES = 48
+
+# Number of voiced segments whose MFCC frames are added up together into column sums
+STATISTICS_BLOCK = 256
+
+# Number of frames of a clip analysed together when the frame store is built, and of segments whose MFCCs are
+# computed together from the store
+CLIP_FRAME_BLOCK = 4096
+FRAME_STORE_SEGMENTS = 64
+
+# Number of merged segments held back by the streaming pipeline, as they may still merge with following segments,
+# and number of merged segments it admits together
+MERGE_WINDOW = 16
+ADMISSION_BLOCK = 1024
+
+# Energy pre-gate on digital silence: a YIN frame is active if the sum of the squares of its samples reaches
+# GATE_ENERGY_LOWER. Below 1e-6 YIN zeroes both its energy and autocorrelation terms, and the frame gets the
+# pitch sr / floor(sr / fmax), above the human range; the gate stays a decade below that, clear of rounding
+# A segment with less than PITCH_RATE_LOWER active frames cannot have enough human pitch frames to be voiced
+GATE_ENERGY_LOWER = 1e-7
+
+# Suppress the "Empty filters detected in mel frequency basis" warning by Librosa, expected with n_fft = 512
+# Slow decoder fallbacks are no longer hidden by a blanket warning filter, but counted and reported
 if not sys.warnoptions:
     import warnings
 
-    warnings.simplefilter("ignore")
+    warnings.filterwarnings("ignore", message="Empty filters detected in mel frequency basis")
+
+# Angles (in degrees) between the average MFCC vectors of all the voiced segment pairs, and their gender decisions
+SegmentAngles = namedtuple('SegmentAngles', ['angles', 'decisions'])
+
+# Number of audio clips read by each decoder, and the clips that needed the slow audioread fallback
+decoder_counts = {}
+slow_decoded_clips = []
+
+# Hits, misses and evictions of the feature cache
+feature_cache_counts = {"hits": 0, "misses": 0, "evicted": 0}
+
+# Clips prefetched through the decode queue, and the time (in seconds) the consumer of the queue waited for a
+# decoded clip and the decoding thread waited for a free place in the queue
+prefetch_counts = {"clips": 0, "compute_wait": 0.0, "decode_wait": 0.0}
+
+# Lock of the counts above, updated by the fetching thread of "--prefetch" while the main thread updates them too
+counts_lock = threading.Lock()
+
+# Clips fetched ahead of time, by path, returned by fetch_clip (as FetchedClip) instead of fetching them again
+preloaded_clips = {}
+
+# Decoded clip (as returned by load_clip), or features read from the feature cache, of a clip about to be
+# extracted, with its feature cache key
+FetchedClip = namedtuple('FetchedClip', ['features', 'key', 'clip'])
+
+# Options of the module, by their name (the command line switch without "--", dashes as underscores, and the
+# keyword of count_speakers), with the module variable each one sets
+OPTION_VARIABLES = {"features": "feature_backend", "check_features": "check_features",
+                    "analysis_rate": "analysis_rate", "yin_rate": "yin_rate", "streaming": "streaming",
+                    "decoder": "decoder", "export_text": "export_text", "energy_gate": "energy_gate",
+                    "angle_matrix": "angle_matrix_budget", "pcm_cache": "pcm_cache_folder",
+                    "pcm_cache_size": "pcm_cache_size", "feature_cache": "feature_cache_folder",
+                    "feature_cache_size": "feature_cache_size", "incremental": "incremental", "jobs": "jobs",
+                    "clip_chunks": "clip_chunks", "prefetch": "prefetch_depth", "segment_length": "SEGMENT_LENGTH",
+                    "frame_store": "frame_store", "same_distance": "MFCC_DIST_SAME_UN",
+                    "diff_distance": "MFCC_DIST_DIFF_UN"}
+
+
+# Function to set the options of the module, given by name (see OPTION_VARIABLES); an option given as None keeps
+# its current value, and the analysis rate is given in Hertz or as "native"
+# Raises ValueError for an unknown option or an invalid value
+def configure(**options):
+    for name, value in options.items():
+        if name not in OPTION_VARIABLES:
+            raise ValueError("Unknown option \"" + name + "\"")
+        if value is None:
+            continue
+        if name == "features" and value not in FEATURE_BACKENDS:
+            raise ValueError("Unknown feature backend \"" + value + "\". Use librosa, batched or fused")
+        if name == "decoder" and value not in DECODERS:
+            raise ValueError("Unknown decoder \"" + value + "\". Use auto, soundfile or audioread")
+        if name == "analysis_rate" and value != "native" and not str(value).isdigit():
+            raise ValueError("Invalid analysis rate \"" + str(value) + "\". Use a rate in Hertz or native")
+        if name == "analysis_rate":
+            value = None if value == "native" else int(value)
+        globals()[OPTION_VARIABLES[name]] = value
+
+
+# Function to read the module variables set by the options
+def option_variables():
+    return {variable: globals()[variable] for variable in OPTION_VARIABLES.values()}
+
+
+# Function to set the module variables read by option_variables, e.g. in a worker process
+def set_option_variables(variables):
+    globals().update(variables)
+
+
+# Context manager setting the options of the module (see configure) for the duration of a call
+@contextmanager
+def configured(**options):
+    variables = option_variables()
+    try:
+        configure(**options)
+        yield
+    finally:
+        set_option_variables(variables)
+
+
+# Function to add the command line switches of the options to the argparse parser 'parser', shared with the
+# scripts built on this module; a switch left out gives None, which keeps the default of the option
+def add_options(parser):
+    parser.add_argument("--features", choices=FEATURE_BACKENDS,
+                        help="feature backend (default librosa)")
+    parser.add_argument("--analysis-rate", help="rate in Hertz, or \"native\", at which the clips are analysed")
+    parser.add_argument("--yin-rate", type=int, help="rate in Hertz of the decimated signal YIN runs on")
+    parser.add_argument("--streaming", action="store_true", default=None,
+                        help="stream the segments through the pipeline without feature files")
+    parser.add_argument("--decoder", choices=DECODERS, help="audio decoder (default auto)")
+    parser.add_argument("--export-text", action="store_true", default=None,
+                        help="also write the feature files as text files")
+    parser.add_argument("--energy-gate", action="store_true", default=None,
+                        help="skip the analysis of digitally silent segments")
+    parser.add_argument("--angle-matrix", type=float, metavar="MEGABYTES",
+                        help="precompute the angles of all the voiced segment pairs within this memory budget")
+    parser.add_argument("--pcm-cache", metavar="FOLDER", help="keep the decoded clips in this folder")
+    parser.add_argument("--pcm-cache-size", type=float, metavar="MEGABYTES",
+                        help="size limit of the PCM cache (default 4096)")
+    parser.add_argument("--feature-cache", metavar="FOLDER", help="keep the features of the clips in this folder")
+    parser.add_argument("--feature-cache-size", type=float, metavar="MEGABYTES",
+                        help="size limit of the feature cache (default 4096)")
+    parser.add_argument("--incremental", action="store_true", default=None,
+                        help="only extract the features of the clips added or modified since the previous run")
+    parser.add_argument("--jobs", type=int, help="number of worker processes extracting the clips")
+    parser.add_argument("--clip-chunks", type=int, help="number of chunks of a clip extracted in parallel")
+    parser.add_argument("--prefetch", type=int, metavar="DEPTH",
+                        help="decode the upcoming clips in a background thread, at most DEPTH clips ahead")
+    parser.add_argument("--segment-length", type=float, metavar="SECONDS", help="length of the segments (default 3)")
+    parser.add_argument("--frame-store", action="store_true", default=None,
+                        help="cut the segments from the stored features of every frame of the clips")
+
+
+# Function to find the options given on the command line, parsed by a parser set up with add_options
+def parsed_options(arguments):
+    return {name: getattr(arguments, name) for name in OPTION_VARIABLES if hasattr(arguments, name)}
 
 
 # Estimate Gender from Pitch feature
@@ -136,60 +330,622 @@ def gender_decision(pitch_a, pitch_b):
         return -1  # leave the job to MFCC
 
 
+# Function to find the duration of an audio clip
+# The duration is read from the WAV/MP3 header, and the clip is decoded only when the header cannot be trusted
 def find_clip_length(path):
-    current_audio, sr = librosa.load(path)
-    audio_duration = librosa.get_duration(y=current_audio, sr=sr)
+    audio_duration = audio_io.probe_duration(path)
+    if audio_duration is None:
+        current_audio, sr = load_clip(path)
+        audio_duration = clip_duration(current_audio, sr)
     return audio_duration
 
-# Function to Derive YIN and MFCC features of a Segment
-def derive_features(file_count, filename, segment_length):
-    YIN = []
-    MFCC = []
-    frame_count = 0
 
-    duration = find_clip_length(path=filename)
+# Function to decode an audio clip only once, at its native sampling rate
+# PCM and floating point WAV clips are memory-mapped instead: the clip is then an array of shape
+# (samples, channels) backed by the file, and each segment is converted to float when it is cut
+# With a PCM cache, a clip decoded by an earlier run is memory-mapped from the cache instead
+def load_clip(path):
+    clip, native_rate, clip_decoder = load_decoded_clip(path)
+    return clip, native_rate
+
+
+# Function to load an audio clip as load_clip does
+# Returns the clip, its native sampling rate and the name of the decoder that produced its samples ('memmap',
+# 'soundfile' or 'audioread'), which for a clip read from the PCM cache is the decoder that filled the entry
+def load_decoded_clip(path):
+    if decoder == "auto":
+        mapped_clip = audio_io.memmap_wav(path)
+        if mapped_clip is not None:
+            add_count(decoder_counts, "memmap")
+            return mapped_clip + ("memmap",)
+
+    if pcm_cache_folder is not None:
+        clip, native_rate, clip_decoder, cache_hit = audio_io.cached_decode_clip(path, decoder, pcm_cache_folder,
+                                                                                 int(pcm_cache_size * 2 ** 20))
+    else:
+        clip, native_rate, clip_decoder = audio_io.decode_clip(path, decoder)
+        cache_hit = False
+    add_count(decoder_counts, "pcm-cache" if cache_hit else clip_decoder)
+    if decoder == "auto" and clip_decoder == "audioread" and not cache_hit:
+        with counts_lock:
+            slow_decoded_clips.append(path)
+    return clip, native_rate, clip_decoder
+
+
+# Function to find which decoder load_clip uses for an audio clip, without decoding it ('memmap', 'soundfile' or
+# 'audioread'), to key the features of the clip on the decoder that produces its samples
+def clip_decoder_name(path):
+    if decoder == "auto" and audio_io.mappable_wav(path) is not None:
+        return "memmap"
+    return audio_io.resolve_decoder(path, decoder)
+
+
+# Function to add 'amount' to the count 'name' of 'counts' (decoder, feature cache or prefetch counts)
+def add_count(counts, name, amount=1):
+    with counts_lock:
+        counts[name] = counts.get(name, 0) + amount
+
+
+# Function to report the number of audio clips read by each decoder, and the clips that needed the slow fallback
+# With a feature cache, its hits, misses and evictions are reported as well
+def report_decoders():
+    # nothing is decoded when all the features come from the feature cache or the incremental feature store
+    if len(decoder_counts) != 0:
+        print("Audio clips read by decoder:",
+              ", ".join(name + " " + str(count) for name, count in decoder_counts.items()))
+    if len(slow_decoded_clips) != 0:
+        print("Slow audioread fallbacks:", len(slow_decoded_clips))
+        for path in slow_decoded_clips:
+            print("Fallback Clip:", path)
+    if feature_cache_folder is not None:
+        print("Feature cache:", ", ".join(name + " " + str(count) for name, count in feature_cache_counts.items()))
+    # a run waiting mostly for decoded clips is decode-bound, one waiting mostly for free places compute-bound
+    if prefetch_counts["clips"] != 0:
+        print("Decode queue: depth", prefetch_depth, "clips", prefetch_counts["clips"],
+              "feature extraction waited", round(prefetch_counts["compute_wait"], 3), "s for decoded clips,",
+              "decoding waited", round(prefetch_counts["decode_wait"], 3), "s for free places")
+
+
+# Function to find the duration of a clip returned by load_clip
+def clip_duration(clip, native_rate):
+    return len(clip) / native_rate
+
+
+# Function to cut a decoded audio clip into consecutive segments of duration 'segment_length'
+# Each segment is sliced at the native rate and then resampled to 'sr', which reproduces
+# the samples of a librosa.load(path, sr=sr, offset=..., duration=...) call per segment
+# Only the segments 'first_segment' to 'stop_segment' (excluded, counted from 0) are cut, if given
+def clip_segments(clip, native_rate, segment_length, duration, sr, first_segment=0, stop_segment=None):
+    for start_sample, end_sample in segment_bounds(native_rate, segment_length, duration, first_segment,
+                                                   stop_segment):
+        yield analysis_segment(clip[start_sample:end_sample], native_rate, sr)
+
+
+# Function to find the first and last (excluded) samples of the segments cut by clip_segments
+def segment_bounds(native_rate, segment_length, duration, first_segment=0, stop_segment=None):
+    segment_num = 0
+    start_segment = 0.0
+    end_segment = start_segment + segment_length
+    while end_segment <= duration and (stop_segment is None or segment_num < stop_segment):
+        if segment_num >= first_segment:
+            start_sample = int(start_segment * native_rate)
+            yield start_sample, start_sample + int(segment_length * native_rate)
+
+        segment_num += 1
+        start_segment = end_segment
+        end_segment = start_segment + segment_length
 
-    # print("Audio Clip", file_count, ":", filename)
-    # print("Audio Clip Duration:", duration)
 
+# Function to turn the samples of a segment, sliced from a clip at 'native_rate', into a mono signal at rate 'sr'
+def analysis_segment(speech_segment, native_rate, sr):
+    if speech_segment.ndim > 1:
+        speech_segment = audio_io.wav_samples_to_float(speech_segment)
+    if native_rate != sr:
+        speech_segment = librosa.resample(speech_segment, orig_sr=native_rate, target_sr=sr)
+    return speech_segment
+
+
+# Function to cut an audio clip file into segments as clip_segments does, without decoding the clip whole:
+# a clip soundfile reads is read one segment at a time, and a memory-mapped WAV clip (or a clip read from the
+# PCM cache) is only paged in one segment at a time; a clip decoded by audioread is still decoded whole
+# Returns the analysis rate of the clip and its segments
+def read_clip_segments(path, segment_length):
+    if pcm_cache_folder is not None or clip_decoder_name(path) != "soundfile":
+        clip, native_rate = load_clip(path)
+        sr = clip_analysis_rate(native_rate)
+        return sr, clip_segments(clip, native_rate, segment_length, clip_duration(clip, native_rate), sr)
+
+    frames, native_rate = audio_io.soundfile_length(path)
+    add_count(decoder_counts, "soundfile")
+    sr = clip_analysis_rate(native_rate)
+    bounds = segment_bounds(native_rate, segment_length, frames / native_rate)
+    return sr, (analysis_segment(samples, native_rate, sr)
+                for samples in audio_io.soundfile_segments(path, bounds))
+
+
+# Function to count the segments of duration 'segment_length' cut from a clip of duration 'duration'
+# by clip_segments
+def clip_segment_count(duration, segment_length):
+    segment_count = 0
     start_segment = 0.0
     end_segment = start_segment + segment_length
-    segment_count = 0
     while end_segment <= duration:
-        # Load a speech segment of duration 'segment_length' from the input audio clip
-        speech_segment, sr = librosa.load(filename, sr = sample_rate, mono=True,
-                                          offset=start_segment, duration=segment_length)
         segment_count += 1
+        start_segment = end_segment
+        end_segment = start_segment + segment_length
+    return segment_count
+
+
+# Function to find the rate at which a clip decoded at 'native_rate' is analysed
+def clip_analysis_rate(native_rate):
+    return native_rate if analysis_rate is None else analysis_rate
+
+
+# Function to scale the frame parameters, given in samples at 'sample_rate', to the rate 'sr'
+# The durations of the frames, and so the number of frames per segment, are kept
+def scaled_frame_parameters(sr):
+    if sr == sample_rate:
+        return frame_length, hop_length, win_length
+    scale = sr / sample_rate
+    return max(int(round(frame_length * scale)), 4), max(int(round(hop_length * scale)), 1), \
+        max(int(round(win_length * scale)), 1)
+
+
+# Function to prepare a segment, or a block of stacked segments, at rate 'sr' for YIN
+# In multi-rate analysis the segment is decimated to 'yin_rate' and only the human pitch range is searched,
+# with frames long enough to hold the period of the lowest human pitch, rounded up to a power of two for the FFT
+# Returns the signal, its rate, the searched pitch range and the frame length, hop length and window length
+def pitch_signal(speech_segment, sr):
+    pitch_fmin = fmin
+    pitch_fmax = fmax
+    if yin_rate:
+        speech_segment = librosa.resample(speech_segment, orig_sr=sr, target_sr=yin_rate, res_type="polyphase")
+        sr = yin_rate
+        pitch_fmin = PITCH_HUMAN_LOWER
+        pitch_fmax = PITCH_HUMAN_UPPER
+
+    yin_frame_length, yin_hop_length, yin_win_length = scaled_frame_parameters(sr)
+    if yin_rate:
+        yin_frame_length = max(yin_frame_length, math.ceil(sr / pitch_fmin) + yin_win_length + 1)
+        yin_frame_length = 1 << (yin_frame_length - 1).bit_length()
+    return speech_segment, sr, pitch_fmin, pitch_fmax, yin_frame_length, yin_hop_length, yin_win_length
+
+
+# Function to calculate the YIN pitch track of a segment, or of a block of stacked segments, at rate 'sr'
+def segment_pitch(speech_segment, sr, batched=False):
+    speech_segment, sr, pitch_fmin, pitch_fmax, yin_frame_length, yin_hop_length, yin_win_length = \
+        pitch_signal(speech_segment, sr)
+    if batched:
+        return feature_engine.batch_yin(speech_segment, sr, pitch_fmin, pitch_fmax, yin_frame_length, yin_win_length,
+                                        yin_hop_length, trough_threshold)
+    return librosa.yin(y=speech_segment, fmin=pitch_fmin, fmax=pitch_fmax, sr=sr, frame_length=yin_frame_length,
+                       win_length=yin_win_length, hop_length=yin_hop_length, trough_threshold=trough_threshold)
+
+
+# Function to calculate the MFCC matrix of a segment, or of a block of stacked segments, at rate 'sr'
+def segment_mfcc_matrix(speech_segment, sr, batched=False):
+    mfcc_n_fft, mfcc_hop_length, mfcc_win_length = scaled_frame_parameters(sr)
+    if batched:
+        return feature_engine.batch_mfcc(speech_segment, sr, mfcc_n_fft, mfcc_hop_length, mfcc_win_length, n_mfcc)
+    return librosa.feature.mfcc(y=speech_segment, sr=sr, n_fft=mfcc_n_fft, hop_length=mfcc_hop_length,
+                                n_mfcc=n_mfcc, win_length=mfcc_win_length)
+
+
+# Function to tell which segments, stacked in rows at rate 'sr', pass the energy pre-gate
+# The gate frames the segments exactly as YIN does; a YIN frame below the silence floor gets the pitch
+# sr / floor(sr / fmax), so the gate lets every segment through when that pitch lies in the human range
+def passes_energy_gate(segments, sr):
+    segments, sr, pitch_fmin, pitch_fmax, yin_frame_length, yin_hop_length, yin_win_length = \
+        pitch_signal(segments, sr)
+    silent_pitch = sr / max(math.floor(sr / pitch_fmax), 1)
+    if PITCH_HUMAN_LOWER <= silent_pitch <= PITCH_HUMAN_UPPER:
+        return np.ones(len(segments), dtype=bool)
+    active_rate = feature_engine.active_frame_rate(segments, yin_frame_length, yin_hop_length, GATE_ENERGY_LOWER)
+    return active_rate >= PITCH_RATE_LOWER
+
+
+# Function to compute the YIN pitch track, the voiced decision and the MFCC matrix of each segment
+# with the given feature backend
+# With 'pitch_first', the pitch is evaluated first and the MFCC matrix is only computed for voiced segments
+# (it is None for the others), as the non-voiced segments are dropped by Remove_Non_Voiced anyway
+# With the energy gate, the segments rejected by the gate get an empty pitch track and are not voiced
+def segment_features(segments, sr, backend=None, pitch_first=True):
+    if backend is None:
+        backend = feature_backend
+
+    if backend == "librosa":
+        for speech_segment in segments:
+            if energy_gate and not passes_energy_gate(speech_segment[None], sr)[0]:
+                yield np.empty(0), False, None
+                continue
+
+            # Calculate average fundamental frequency of the segment
+            f0 = segment_pitch(speech_segment, sr)
+            voiced = bool(block_voiced(f0[None], [len(f0)])[0][0])
+
+            # Calculate MFCCs for the segment
+            segment_mfcc = None
+            if voiced or not pitch_first:
+                segment_mfcc = segment_mfcc_matrix(speech_segment, sr)
+            yield f0, voiced, segment_mfcc
+    else:
+        block = []
+        for speech_segment in segments:
+            block.append(speech_segment)
+            if len(block) == BATCH_SEGMENTS:
+                yield from batch_segment_features(block, sr, backend, pitch_first)
+                block = []
+        if block:
+            yield from batch_segment_features(block, sr, backend, pitch_first)
+
+
+# Function to compute the YIN pitch tracks, the voiced decisions and the MFCC matrices of a block of segments
+# in one vectorized pass
+# The fused backend needs YIN and MFCC on the same frames, so it is only used without a decimated YIN signal,
+# and it computes the MFCCs of every segment together with the pitch
+def batch_segment_features(block, sr, backend, pitch_first):
+    segments = np.stack(block)
+    f0 = [np.empty(0)] * len(block)
+    voiced = [False] * len(block)
+    block_mfcc = [None] * len(block)
+
+    # Segments analysed, after the energy gate
+    analysed = np.arange(len(block))
+    if energy_gate:
+        analysed = np.flatnonzero(passes_energy_gate(segments, sr))
+        if len(analysed) == 0:
+            return zip(f0, voiced, block_mfcc)
+
+    if backend == "fused" and not yin_rate:
+        segment_frame_length, segment_hop_length, segment_win_length = scaled_frame_parameters(sr)
+        analysed_f0, analysed_mfcc = feature_engine.fused_features(segments[analysed], sr, fmin, fmax,
+                                                                   segment_frame_length, segment_win_length,
+                                                                   segment_hop_length, trough_threshold, n_mfcc)
+        analysed_voiced = block_voiced(analysed_f0, np.full(len(analysed), analysed_f0.shape[1]))[0]
+        for i, segment_f0, segment_voiced, segment_mfcc in zip(analysed, analysed_f0, analysed_voiced, analysed_mfcc):
+            f0[i] = segment_f0
+            voiced[i] = bool(segment_voiced)
+            block_mfcc[i] = segment_mfcc
+    else:
+        analysed_f0 = segment_pitch(segments[analysed], sr, batched=True)
+        analysed_voiced = block_voiced(analysed_f0, np.full(len(analysed), analysed_f0.shape[1]))[0]
+        for i, segment_f0, segment_voiced in zip(analysed, analysed_f0, analysed_voiced):
+            f0[i] = segment_f0
+            voiced[i] = bool(segment_voiced)
+
+        # Calculate MFCCs only for the selected segments of the block
+        selected = analysed[[voiced[i] for i in analysed]] if pitch_first else analysed
+        if len(selected) != 0:
+            for i, segment_mfcc in zip(selected, segment_mfcc_matrix(segments[selected], sr, batched=True)):
+                block_mfcc[i] = segment_mfcc
+    return zip(f0, voiced, block_mfcc)
+
+
+# Function to check the selected feature backend and analysis rates against the per-segment librosa computation
+# at 'sample_rate' on an audio clip. Pitch tracks and MFCCs are compared frame by frame when they are computed on
+# the same frames, and the voiced/non-voiced decisions of the segments are always compared
+# Returns True when all the differences are within the tolerances
+def check_feature_backend(filename):
+    clip, native_rate = load_clip(filename)
+    duration = clip_duration(clip, native_rate)
+    reference_segments = list(clip_segments(clip, native_rate, SEGMENT_LENGTH, duration, sample_rate))
+    sr = clip_analysis_rate(native_rate)
+    segments = reference_segments
+    if sr != sample_rate:
+        segments = list(clip_segments(clip, native_rate, SEGMENT_LENGTH, duration, sr))
+    same_frames = sr == sample_rate and not yin_rate
 
-        # Calculate average fundamental frequency of the segment
-        f0 = librosa.yin(y=speech_segment, fmin=fmin, fmax=fmax, sr=sr, frame_length=frame_length,
-                         win_length=win_length, hop_length=hop_length, trough_threshold=trough_threshold)
-        # print("YIN Frames:",len(f0))
+    frame_count = 0
+    pitch_mismatch_count = 0
+    mfcc_deviation = 0.0
+    voiced_mismatch_count = 0
+    features = segment_features(segments, sr, pitch_first=False)
+    for ref_segment, (f0, voiced, segment_mfcc) in zip(reference_segments, features):
+        ref_f0 = librosa.yin(y=ref_segment, fmin=fmin, fmax=fmax, sr=sample_rate, frame_length=frame_length,
+                             win_length=win_length, hop_length=hop_length, trough_threshold=trough_threshold)
+        if voiced != block_voiced(ref_f0[None], [len(ref_f0)])[0][0]:
+            voiced_mismatch_count += 1
+
+        if same_frames and segment_mfcc is not None:
+            ref_mfcc = librosa.feature.mfcc(y=ref_segment, sr=sample_rate, n_fft=n_fft, hop_length=hop_length,
+                                            n_mfcc=n_mfcc, win_length=win_length)
+            frame_count += len(ref_f0)
+            pitch_mismatch_count += np.count_nonzero(np.abs(f0 - ref_f0) > PITCH_RELATIVE_TOLERANCE * ref_f0)
+            mfcc_deviation = max(mfcc_deviation, float(np.max(np.abs(segment_mfcc - ref_mfcc))))
+
+    passed = pitch_mismatch_count <= PITCH_MISMATCH_RATE * frame_count and \
+        mfcc_deviation <= MFCC_ABSOLUTE_TOLERANCE and voiced_mismatch_count <= VOICED_MISMATCH_RATE * len(segments)
+    print("Clip:", filename, "Segments:", len(segments), "Voiced Decision Mismatches:", voiced_mismatch_count,
+          "Pitch Mismatch Frames:", pitch_mismatch_count, "of", frame_count, "Max MFCC Deviation:", mfcc_deviation,
+          "Status:", "passed" if passed else "FAILED")
+    return passed
 
-        # for x in f0:
-        pitch_tuple = (file_count, segment_count) + tuple(f0)
 
-        YIN.append(pitch_tuple)
+# Function to Derive YIN and MFCC features of a Segment
+# MFCC features are only derived for the voiced segments; the number of MFCC computations avoided
+# and the number of segments skipped by the energy gate are returned
+# With a feature cache, the features of a clip already seen are read from the cache instead
+# 'fetched' is the FetchedClip of the clip if it was already fetched by fetch_clip
+# The keyword parameters override the options of the module (see configure) for this call only; None keeps them
+def derive_features(file_count, filename, segment_length, fetched=None, features=None, analysis_rate=None,
+                    yin_rate=None, energy_gate=None, decoder=None):
+    with configured(features=features, analysis_rate=analysis_rate, yin_rate=yin_rate, energy_gate=energy_gate,
+                    decoder=decoder):
+        return derive_configured_features(file_count, filename, segment_length, fetched)
+
+
+# Function to Derive YIN and MFCC features of a clip with the options of the module, for derive_features
+def derive_configured_features(file_count, filename, segment_length, fetched):
+    if fetched is None:
+        fetched = fetch_clip(file_count, filename, segment_length)
+    if fetched.features is not None:
+        return fetched.features
+    key = fetched.key
+
+    clip, native_rate = fetched.clip
+    duration = clip_duration(clip, native_rate)
 
-        # Calculate MFCCs for the segment
-        segment_mfcc = librosa.feature.mfcc(speech_segment, sr=sr, n_fft=n_fft, hop_length=hop_length, n_mfcc=n_mfcc,
-                                            win_length=win_length)
+    # print("Audio Clip", file_count, ":", filename)
+    # print("Audio Clip Duration:", duration)
 
-        # Deselect the first coefficient for not modeling DC component of the audio signal (as per crowd++ paper)
-        segment_mfcc_select = segment_mfcc[1:]
-        segment_mfcc_tr = segment_mfcc_select.transpose()
+    if clip_chunks > 1:
+        features = feature_cache.ClipFeatures(duration, *chunked_clip_features(file_count, clip, native_rate,
+                                                                               segment_length))
+    else:
+        features = feature_cache.ClipFeatures(duration, *clip_features(file_count, clip, native_rate, segment_length))
+    if feature_cache_folder is not None:
+        add_count(feature_cache_counts, "evicted",
+                  feature_cache.write_cached_features(feature_cache_folder, key, features,
+                                                      int(feature_cache_size * 2 ** 20)))
+    return features
+
+
+# Function to fetch what derive_features needs to derive the features of a clip: its features from the feature
+# cache if they are cached, its decoded samples otherwise; a clip fetched ahead of time (see preloaded_clips) is
+# returned as it is
+# Returns a FetchedClip
+def fetch_clip(file_count, filename, segment_length):
+    if filename in preloaded_clips:
+        return preloaded_clips.pop(filename)
+
+    if feature_cache_folder is None:
+        # Decode (or memory-map) the audio clip once, instead of seeking and decoding it again for every segment
+        return FetchedClip(None, None, load_clip(filename))
+
+    clip_hash = feature_cache.content_hash(filename)
+    key = feature_cache.feature_cache_key(clip_hash, feature_parameters(segment_length, clip_decoder_name(filename)))
+    cached = feature_cache.read_cached_features(feature_cache_folder, key, file_count)
+    if cached is not None:
+        add_count(feature_cache_counts, "hits")
+        # the size limit may have been lowered since the cache was filled
+        add_count(feature_cache_counts, "evicted",
+                  feature_cache.evict_cached_features(feature_cache_folder, key, int(feature_cache_size * 2 ** 20)))
+        return FetchedClip(cached, key, None)
+    add_count(feature_cache_counts, "misses")
+
+    clip, native_rate, clip_decoder = load_decoded_clip(filename)
+    # the features are cached under the decoder that actually produced the samples
+    key = feature_cache.feature_cache_key(clip_hash, feature_parameters(segment_length, clip_decoder))
+    return FetchedClip(None, key, (clip, native_rate))
+
+
+# Function to apply 'fetch' to every item of 'items' in a background thread, at most 'depth' items ahead of the
+# caller, and to yield the results in order, so that the clips are decoded while the caller extracts features
+# The time the caller waits for a result, and the thread for a free place in the queue, are added to
+# prefetch_counts; an exception raised by 'fetch' is raised again to the caller
+def prefetched(items, depth, fetch):
+    fetched_queue = queue.Queue(maxsize=max(depth, 1))
+
+    def fetch_items():
+        for item in items:
+            try:
+                result = (fetch(item), None)
+            except Exception as error:
+                result = (None, error)
+            start = perf_counter()
+            fetched_queue.put(result)
+            add_count(prefetch_counts, "decode_wait", perf_counter() - start)
+            if result[1] is not None:
+                return
+
+    # a daemon thread, so that an interrupted run does not wait for the decoding of the queued clips
+    fetching_thread = threading.Thread(target=fetch_items, daemon=True)
+    fetching_thread.start()
+    for _ in items:
+        start = perf_counter()
+        result, error = fetched_queue.get()
+        add_count(prefetch_counts, "compute_wait", perf_counter() - start)
+        if error is not None:
+            raise error
+        add_count(prefetch_counts, "clips")
+        yield result
+    fetching_thread.join()
+
+
+# Function to find the features stored for the clip 'file' of the folder 'folder_name' in the manifest folder
+# 'manifest_folder' of an incremental run, which are reused while the clip and the feature extraction parameters
+# are unchanged
+# Returns the features, or None if the clip needs to be extracted, with the feature key of the clip
+def stored_features(manifest_folder, manifest, folder_name, file, file_count):
+    entry = clip_manifest.clip_entry(manifest, folder_name, file)
+    key = feature_cache.feature_cache_key(entry['sha256'],
+                                          feature_parameters(SEGMENT_LENGTH,
+                                                             clip_decoder_name(os.path.join(folder_name, file))))
+    if entry.get('features') != key:
+        return None, key
+    return feature_cache.read_cached_features(manifest_folder, key, file_count), key
+
+
+# Function to store the features of the clip 'file', just extracted in an incremental run, with its feature key
+def store_features(manifest_folder, manifest, file, key, features):
+    # the feature store is pruned of unused features by clip_manifest.prune_manifest, not by size
+    feature_cache.write_cached_features(manifest_folder, key, features, float('inf'))
+    manifest['clips'][file]['features'] = key
+
+
+# Function to Derive YIN and MFCC features of the clips listed as (file count, path) pairs in 'tasks'
+# With "--jobs", the clips are extracted by a pool of worker processes, one clip per task; the features are
+# returned in the order of 'tasks' in any case, and the decoder and feature cache counts of the workers are added
+# to those of this process
+# Otherwise, with "--prefetch", the clips are decoded by a background thread while the features are extracted
+def derive_clip_features(tasks):
+    if (jobs <= 1 or len(tasks) <= 1) and prefetch_depth > 0 and len(tasks) > 1:
+        fetched_clips = prefetched(tasks, prefetch_depth,
+                                   lambda task: fetch_clip(task[0], task[1], SEGMENT_LENGTH))
+        return [derive_features(file_count, path, SEGMENT_LENGTH, fetched)
+                for (file_count, path), fetched in zip(tasks, fetched_clips)]
+    if jobs <= 1 or len(tasks) <= 1:
+        return [derive_features(file_count, path, SEGMENT_LENGTH) for file_count, path in tasks]
+
+    # The options of this process are set in every worker, which a spawned worker would not inherit
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+    features_list = []
+    with ProcessPoolExecutor(max_workers=min(jobs, len(tasks)), mp_context=context,
+                             initializer=set_option_variables, initargs=(option_variables(),)) as executor:
+        for features, clip_decoder_counts, clip_slow_decoded_clips, clip_feature_cache_counts in \
+                executor.map(derive_features_task, tasks):
+            features_list.append(features)
+            for name, count in clip_decoder_counts.items():
+                decoder_counts[name] = decoder_counts.get(name, 0) + count
+            slow_decoded_clips.extend(clip_slow_decoded_clips)
+            for name, count in clip_feature_cache_counts.items():
+                feature_cache_counts[name] += count
+    return features_list
+
+
+# Function to Derive YIN and MFCC features of a clip in a worker process of derive_clip_features
+# Returns the features with the decoder and feature cache counts of the clip
+def derive_features_task(task):
+    file_count, path = task
+    # the clips are already extracted in parallel, one per worker
+    global clip_chunks
+    clip_chunks = 1
+    decoder_counts.clear()
+    del slow_decoded_clips[:]
+    for name in feature_cache_counts:
+        feature_cache_counts[name] = 0
+    features = derive_features(file_count, path, SEGMENT_LENGTH)
+    return features, dict(decoder_counts), list(slow_decoded_clips), dict(feature_cache_counts)
+
+
+# Function to list the parameters the features of a clip depend on, besides its content, to key the feature cache
+# The voicing thresholds are included, as the MFCC features are only kept for the voiced segments, and so is the
+# decoder that produces the samples of the clip ('clip_decoder', see clip_decoder_name) rather than the one asked for
+def feature_parameters(segment_length, clip_decoder):
+    return {'segment_length': segment_length, 'sample_rate': sample_rate, 'analysis_rate': analysis_rate,
+            'yin_rate': yin_rate, 'frame_length': frame_length, 'hop_length': hop_length, 'win_length': win_length,
+            'fmin': fmin, 'fmax': fmax, 'trough_threshold': trough_threshold, 'n_fft': n_fft, 'n_mfcc': n_mfcc,
+            'features': feature_backend, 'energy_gate': energy_gate, 'decoder': clip_decoder,
+            'pitch_human': (PITCH_HUMAN_LOWER, PITCH_HUMAN_UPPER), 'pitch_rate_lower': PITCH_RATE_LOWER,
+            'pitch_mu': (PITCH_MU_LOWER, PITCH_MU_UPPER), 'pitch_sigma_upper': PITCH_SIGMA_UPPER,
+            'voicing_tolerance': VOICING_TOLERANCE, 'gate_energy_lower': GATE_ENERGY_LOWER,
+            'librosa': librosa.__version__}
+
+
+# Function to Derive YIN and MFCC features of the Segments of a decoded audio clip
+# The features are returned as feature tables (see feature_io): YIN in double precision, MFCC in single precision
+# Only the segments 'first_segment' to 'stop_segment' (excluded, counted from 0) are derived, if given, keeping
+# their segment numbers in the clip
+def clip_features(file_count, clip, native_rate, segment_length, first_segment=0, stop_segment=None):
+    yin_segments = []
+    YIN = []
+    mfcc_segments = []
+    MFCC = []
+    mfcc_avoided = 0
+    gate_skipped = 0
+
+    duration = clip_duration(clip, native_rate)
+    sr = clip_analysis_rate(native_rate)
+    segment_count = first_segment
+    segments = clip_segments(clip, native_rate, segment_length, duration, sr, first_segment, stop_segment)
+    for f0, voiced, segment_mfcc in segment_features(segments, sr):
+        segment_count += 1
+        # print("YIN Frames:",len(f0))
 
-        mfcc_tuple = ()
-        frame_count = len(segment_mfcc_tr)
-        for i in range(frame_count):
-            mfcc_tuple = mfcc_tuple + tuple(segment_mfcc_tr[i])
+        yin_segments.append(segment_count)
+        YIN.append(np.asarray(f0, dtype=np.float64))
 
-        MFCC.append((file_count, segment_count) + mfcc_tuple)
+        if len(f0) == 0:
+            gate_skipped += 1
+        if segment_mfcc is None:
+            mfcc_avoided += 1
+        # Non-voiced segments are removed by Remove_Non_Voiced, so their MFCCs are not stored
+        if not voiced:
+            continue
 
-        start_segment = end_segment
-        end_segment = start_segment + segment_length
+        # Deselect the first coefficient for not modeling DC component of the audio signal (as per crowd++ paper)
+        # and list the MFCCs frame by frame
+        segment_mfcc_tr = segment_mfcc[1:].transpose()
+        mfcc_segments.append(segment_count)
+        MFCC.append(segment_mfcc_tr.ravel())
+
+    YIN = feature_io.segment_table(([file_count] * len(yin_segments), yin_segments), YIN, feature_io.SEGMENT_FIELDS,
+                                   np.float64)
+    MFCC = feature_io.segment_table(([file_count] * len(mfcc_segments), mfcc_segments), MFCC,
+                                    feature_io.SEGMENT_FIELDS)
+    return segment_count - first_segment, mfcc_avoided, gate_skipped, YIN, MFCC
+
+
+# Function to Derive YIN and MFCC features of the Segments of a decoded audio clip in "--clip-chunks" chunks of
+# consecutive segments, extracted in parallel worker processes
+# The clip is passed to the workers, and their feature tables returned, through shared memory (see
+# feature_io.share_array); the tables are joined in segment order, so the result is the one of clip_features
+def chunked_clip_features(file_count, clip, native_rate, segment_length):
+    total_segments = clip_segment_count(clip_duration(clip, native_rate), segment_length)
+    chunks = min(clip_chunks, total_segments)
+    if chunks <= 1:
+        return clip_features(file_count, clip, native_rate, segment_length)
+
+    # the workers share the resource tracker of this process, which then owns all the shared memory blocks
+    resource_tracker.ensure_running()
+    shared_clip = feature_io.share_array(clip)
+    bounds = [total_segments * i // chunks for i in range(chunks + 1)]
+    tasks = [(shared_clip, native_rate, file_count, segment_length, bounds[i], bounds[i + 1]) for i in range(chunks)]
+    # The options of this process are set in every worker, which a spawned worker would not inherit
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
 
-    return duration, segment_count, frame_count, YIN, MFCC
+    segment_count = 0
+    mfcc_avoided = 0
+    gate_skipped = 0
+    YIN_tables = []
+    MFCC_tables = []
+    try:
+        with ProcessPoolExecutor(max_workers=chunks, mp_context=context, initializer=set_option_variables,
+                                 initargs=(option_variables(),)) as executor:
+            for chunk_segment_count, chunk_mfcc_avoided, chunk_gate_skipped, shared_YIN, shared_MFCC in \
+                    executor.map(chunk_features_task, tasks):
+                segment_count += chunk_segment_count
+                mfcc_avoided += chunk_mfcc_avoided
+                gate_skipped += chunk_gate_skipped
+                YIN_tables.append(feature_io.read_shared_feature_table(shared_YIN))
+                MFCC_tables.append(feature_io.read_shared_feature_table(shared_MFCC))
+    finally:
+        feature_io.release_shared_array(shared_clip)
+
+    return segment_count, mfcc_avoided, gate_skipped, \
+        feature_io.concatenate_tables(YIN_tables, feature_io.SEGMENT_FIELDS, np.float64), \
+        feature_io.concatenate_tables(MFCC_tables, feature_io.SEGMENT_FIELDS)
+
+
+# Function to Derive YIN and MFCC features of a chunk of segments of a clip in a worker process of
+# chunked_clip_features
+# Returns the counts of the chunk and its feature tables, shared through shared memory blocks
+def chunk_features_task(task):
+    shared_clip, native_rate, file_count, segment_length, first_segment, stop_segment = task
+    clip, block = feature_io.attach_shared_array(shared_clip)
+    segment_count, mfcc_avoided, gate_skipped, YIN, MFCC = \
+        clip_features(file_count, clip, native_rate, segment_length, first_segment, stop_segment)
+    del clip
+    if block is not None:
+        block.close()
+    return segment_count, mfcc_avoided, gate_skipped, feature_io.share_feature_table(YIN), \
+        feature_io.share_feature_table(MFCC)
 
 
 # Function to write the feature vectors to feature file
@@ -205,180 +961,480 @@ def file_write(feature_List, output_file):
         f.close()
 
 
+# Function to write the feature tuples of the segments to a binary feature file
+# 'fields' names the header fields at the beginning of each tuple, and 'value_type' the type of the feature values
+# (see feature_io)
+def feature_write(feature_List, output_file, fields, value_type=feature_io.VALUE_TYPE):
+    feature_io.write_feature_file(feature_List, output_file, fields, export_text, value_type)
+
+
+# Function to write the feature table of the segments to a binary feature file, its values converted to
+# 'value_type' if given (see feature_io)
+def table_write(table, output_file, value_type=None):
+    feature_io.write_feature_table(table, output_file, export_text, value_type)
+
+
 # Function to Generate Feature Vectors for the Speech Audio Clips in the Input Directory
 def Generate_Feature_Files(folder_name, extension, outfile_1, outfile_2):
+    if frame_store:
+        return Generate_Frame_Store_Feature_Files(folder_name, extension, outfile_1, outfile_2)
+
     # file_metadata_List = []
-    YIN_List = []
-    MFCC_List = []
+    YIN_tables = []
+    MFCC_tables = []
 
     if not os.listdir(folder_name):
-        sys.exit("No file in folder \"" + speech_folder_name + "\"")
+        sys.exit("No file in folder \"" + folder_name + "\"")
+
+    # Check the extension of the files; the clips are numbered in the order of the folder listing
+    files = [file for file in os.listdir(folder_name) if file.endswith(extension)]
+    if len(files) == 0:
+        sys.exit("No files in folder \"" + folder_name + "\" has supported audio file extesion")
+
+    features_list = [None] * len(files)
+    if incremental:
+        manifest_folder = os.path.join(folder_name, incremental_directory)
+        manifest = clip_manifest.read_manifest(manifest_folder)
+        keys = [None] * len(files)
+        for i, file in enumerate(files):
+            features_list[i], keys[i] = stored_features(manifest_folder, manifest, folder_name, file, i + 1)
+
+    pending = [i for i, features in enumerate(features_list) if features is None]
+    for i, features in zip(pending, derive_clip_features([(i + 1, folder_name + f"/{files[i]}") for i in pending])):
+        features_list[i] = features
+        if incremental:
+            store_features(manifest_folder, manifest, files[i], keys[i], features)
+
+    if incremental:
+        removed = clip_manifest.prune_manifest(manifest_folder, manifest, files)
+        clip_manifest.write_manifest(manifest_folder, manifest)
+        print("Incremental run: clips extracted", len(pending), "reused", len(files) - len(pending),
+              "removed", removed)
 
-    file_count = 0
     tot_segments = 0
+    tot_mfcc_avoided = 0
+    tot_gate_skipped = 0
     segment_count = 0
-    frame_count = 0
-    for file in os.listdir(folder_name):
-        # Check the extension of the file
-        if file.endswith(extension):
-            rel_file_path = folder_name + f"/{file}"
-            # extract the name of the file (without file extension)
-            # file_name = os.path.splitext(file)[0]
-            # # split file_name entries by '_' character
-            # items = file_name.split('_')
-
-            file_count += 1
-            speech_duration, segment_count, frame_count, this_YIN_List, this_MFCC_List = \
-                derive_features(file_count, rel_file_path, SEGMENT_LENGTH)
-            YIN_List = YIN_List + this_YIN_List
-            MFCC_List = MFCC_List + this_MFCC_List
-            tot_segments += segment_count
-
-            # file_metadata = [file_count, file, speech_duration, segment_count] + items
-            # file_metadata_List.append(file_metadata)
-
-    if file_count == 0:
-        sys.exit("No files in folder \"" + speech_folder_name + "\" has supported audio file extesion")
-
-    file_write(YIN_List, outfile_1)
-    file_write(MFCC_List, outfile_2)
+    for features in features_list:
+        # extract the name of the file (without file extension)
+        # file_name = os.path.splitext(file)[0]
+        # # split file_name entries by '_' character
+        # items = file_name.split('_')
+
+        speech_duration, segment_count, mfcc_avoided, gate_skipped, YIN_table, MFCC_table = features
+        YIN_tables.append(YIN_table)
+        MFCC_tables.append(MFCC_table)
+        tot_segments += segment_count
+        tot_mfcc_avoided += mfcc_avoided
+        tot_gate_skipped += gate_skipped
+
+        # file_metadata = [file_count, file, speech_duration, segment_count] + items
+        # file_metadata_List.append(file_metadata)
+
+    table_write(feature_io.concatenate_tables(YIN_tables, feature_io.SEGMENT_FIELDS), outfile_1, feature_io.VALUE_TYPE)
+    table_write(feature_io.concatenate_tables(MFCC_tables, feature_io.SEGMENT_FIELDS), outfile_2)
     # file_write(file_metadata_List, meta_info_file)
 
-    # print(file_count, "supported Audio Clips in folder \"" + speech_folder_name + "\"", "\n")
+    if energy_gate:
+        print("Segments skipped by the energy gate:", tot_gate_skipped, "of", tot_segments)
+    print("MFCC computations avoided for non-voiced segments:", tot_mfcc_avoided, "of", tot_segments)
 
-    return tot_segments, frame_count
+    # print(file_count, "supported Audio Clips in folder \"" + speech_folder_name + "\"", "\n")
 
+    return tot_segments
 
-# Function to Remove Non-voiced Segments
-def Remove_Non_Voiced(in_file1, in_file2, frame_count, out_file):
-    with open(in_file1, "r") as f:
-        csv_reader = csv.reader(f, delimiter=',')
-
-        line_count = 0
-        revised_YIN_List = []
-
-        for row in csv_reader:
-            curr_audio_num = int(row[0])
-            curr_segment_num = int(row[1])
-            segment_pitch = row[2:]
-
-            c = 0
-            temp_pitch = []
-            for curr_pitch in segment_pitch:
-                if float(curr_pitch) >= PITCH_HUMAN_LOWER and float(curr_pitch) <= PITCH_HUMAN_UPPER:
-                    c += 1
-                    temp_pitch.append(float(curr_pitch))
-            if len(temp_pitch) != 0:
-                pitch_rate = c / len(segment_pitch)
-                pitch_mu = statistics.mean(temp_pitch)
-                pitch_sigma = statistics.stdev(temp_pitch)
-                # print("Audio Num:", curr_audio_num, "Segment Num:", curr_segment_num, "Status: Voiced")
-            else:
-                pitch_rate = 0.0
-                pitch_mu = 0.0
-                pitch_sigma = 0.0
-                # print("Audio Num:", curr_audio_num, "Segment Num:", curr_segment_num, "Status: Non-voiced")
 
-            if pitch_rate >= PITCH_RATE_LOWER and \
-                    pitch_mu >= PITCH_MU_LOWER and pitch_mu <= PITCH_MU_UPPER and pitch_sigma <= PITCH_SIGMA_UPPER:
-                revised_YIN_List.append((curr_audio_num, curr_segment_num, pitch_mu))
-                line_count += 1
+# Function to find the files of the frame store kept next to the feature file 'outfile': the frame level pitch
+# and log mel power of the clips, and the identity of the clips they were extracted from
+def frame_store_files(outfile):
+    directory = os.path.dirname(outfile)
+    return tuple(os.path.join(directory, name + feature_file_extension)
+                 for name in ('frames.YIN', 'frames.MEL', 'frames.clips'))
 
-        if line_count == 0:
-            return line_count
 
-        # file_write(revised_YIN_List, out_file1)
-
-    f.close()
+# Function to list the audio clips of a folder, in the order of Generate_Feature_Files, with their size and
+# modification time, after the options the frames depend on: a frame store is only reused while this identity
+# is unchanged
+def frame_store_identity(folder_name, extension):
+    identity = ["analysis_rate=" + str(analysis_rate) + " decoder=" + decoder + " yin_rate=" + str(yin_rate)]
+    for file in os.listdir(folder_name):
+        if file.endswith(extension):
+            stat = os.stat(folder_name + f"/{file}")
+            identity.append(file + ":" + str(stat.st_size) + ":" + str(stat.st_mtime_ns))
+    return np.array(identity)
+
+
+# Function to derive the frame level features of a decoded audio clip: the YIN pitch and the log mel power of
+# every frame, the whole clip being resampled to the analysis rate and framed at once
+# Returns the analysis rate, the hop length at that rate, and the pitch and log mel power matrix of the frames
+def clip_frame_features(clip, native_rate):
+    sr = clip_analysis_rate(native_rate)
+    y = audio_io.wav_samples_to_float(clip) if clip.ndim > 1 else clip
+    if native_rate != sr:
+        y = librosa.resample(y, orig_sr=native_rate, target_sr=sr)
+
+    clip_frame_length, clip_hop_length, clip_win_length = scaled_frame_parameters(sr)
+    f0 = feature_engine.clip_yin(y, sr, fmin, fmax, clip_frame_length, clip_win_length, clip_hop_length,
+                                 trough_threshold, CLIP_FRAME_BLOCK)
+    log_mel = feature_engine.clip_mel_log_power(y, sr, clip_frame_length, clip_hop_length, clip_win_length,
+                                                CLIP_FRAME_BLOCK)
+    return sr, clip_hop_length, f0, log_mel
+
+
+# Function to extract the frame level features of the audio clips in the input directory into the frame store
+# files 'pitch_file' and 'mel_file', one row per clip (see feature_io.CLIP_FRAME_FIELDS)
+def Build_Frame_Store(folder_name, extension, pitch_file, mel_file):
+    columns = ([], [], [], [])
+    pitch_rows = []
+    mel_rows = []
+    file_count = 0
+    for file in os.listdir(folder_name):
+        if file.endswith(extension):
+            file_count += 1
+            clip, native_rate = load_clip(folder_name + f"/{file}")
+            sr, clip_hop_length, f0, log_mel = clip_frame_features(clip, native_rate)
+            for column, value in zip(columns, (file_count, clip_duration(clip, native_rate), sr, clip_hop_length)):
+                column.append(value)
+            pitch_rows.append(f0)
+            mel_rows.append(log_mel.ravel())
+
+    feature_io.write_feature_table(feature_io.segment_table(columns, pitch_rows, feature_io.CLIP_FRAME_FIELDS),
+                                   pitch_file)
+    feature_io.write_feature_table(feature_io.segment_table(columns, mel_rows, feature_io.CLIP_FRAME_FIELDS),
+                                   mel_file)
+    return file_count
+
+
+# Function to find the first frame of each segment of duration 'segment_length' of a clip in the frame store,
+# and the number of frames of its segments, as when each segment is framed on its own
+# The segments are cut as by clip_segments; a segment starts at the frame nearest to its first sample
+def frame_store_segments(duration, sr, clip_hop_length, total_frames, segment_length):
+    segment_frames = 1 + int(segment_length * sr) // clip_hop_length
+    first_frames = []
+    start_segment = 0.0
+    end_segment = start_segment + segment_length
+    while end_segment <= duration:
+        first_frame = int(round(start_segment * sr / clip_hop_length))
+        if first_frame + segment_frames > total_frames:
+            break
+        first_frames.append(first_frame)
+        start_segment = end_segment
+        end_segment = start_segment + segment_length
+    return np.array(first_frames, dtype=np.int64), segment_frames
 
-    with open(in_file2, "r") as f:
-        csv_reader = csv.reader(f, delimiter=',')
 
-        mfcc_line_count = 0
-        revised_MFCC_List = []
+# Function to cut the segments of duration 'segment_length' from the frame store files 'pitch_file' and 'mel_file'
+# Returns the YIN and MFCC feature tables of the segments, as clip_features returns them for every clip, and the
+# total number of segments
+def resegment_frame_store(pitch_file, mel_file, segment_length):
+    pitch_table = feature_io.read_feature_file(pitch_file)
+    mel_table = feature_io.read_feature_file(mel_file)
 
-        for row in csv_reader:
-            curr_audio_num = int(row[0])
-            curr_segment_num = int(row[1])
-            segment_mfcc_str = np.array(row[2:])
-            segment_mfcc = segment_mfcc_str.astype(float)
+    YIN_tables = []
+    MFCC_tables = []
+    tot_segments = 0
+    for clip_header, mel_header in zip(pitch_table.header, mel_table.header):
+        f0 = pitch_table.values[clip_header['offset']:clip_header['offset'] + clip_header['length']]
+        log_mel = mel_table.values[mel_header['offset']:mel_header['offset'] + mel_header['length']]
+        log_mel = log_mel.reshape(len(f0), -1)
+
+        first_frames, segment_frames = frame_store_segments(clip_header['duration'], clip_header['sample_rate'],
+                                                            clip_header['hop_length'], len(f0), segment_length)
+        frame_index = first_frames[:, None] + np.arange(segment_frames)
+        segment_count = len(first_frames)
+        pitch = f0[frame_index]
+        voiced, pitch_mu = block_voiced(pitch, np.full(segment_count, segment_frames))
+
+        # Deselect the first coefficient, and list the MFCCs frame by frame, as clip_features does
+        voiced_segments = np.flatnonzero(voiced)
+        mfcc_rows = [np.zeros((0, segment_frames * (n_mfcc - 1)), dtype=feature_io.VALUE_TYPE)]
+        for start in range(0, len(voiced_segments), FRAME_STORE_SEGMENTS):
+            block = frame_index[voiced_segments[start:start + FRAME_STORE_SEGMENTS]]
+            segment_mfcc = feature_engine.mfcc_from_log_power(log_mel[block].astype(np.float64), n_mfcc)
+            mfcc_rows.append(segment_mfcc[:, 1:, :].swapaxes(1, 2).reshape(len(block), -1))
+
+        audio_num = clip_header['audio_num']
+        YIN_tables.append(feature_io.matrix_table((audio_num, np.arange(1, segment_count + 1)), pitch,
+                                                  feature_io.SEGMENT_FIELDS))
+        MFCC_tables.append(feature_io.matrix_table((audio_num, voiced_segments + 1), np.concatenate(mfcc_rows),
+                                                   feature_io.SEGMENT_FIELDS))
+        tot_segments += segment_count
+
+    return feature_io.concatenate_tables(YIN_tables, feature_io.SEGMENT_FIELDS), \
+        feature_io.concatenate_tables(MFCC_tables, feature_io.SEGMENT_FIELDS), tot_segments
+
+
+# Function to Generate Feature Vectors for the Speech Audio Clips in the Input Directory from the frame store,
+# extracting the frame level features of the clips only when the store is missing or the clips have changed
+def Generate_Frame_Store_Feature_Files(folder_name, extension, outfile_1, outfile_2):
+    if not os.listdir(folder_name):
+        sys.exit("No file in folder \"" + folder_name + "\"")
 
-            if revised_YIN_List[mfcc_line_count][0] == curr_audio_num and \
-                    revised_YIN_List[mfcc_line_count][1] == curr_segment_num:
-                revised_MFCC_List.append((curr_audio_num, curr_segment_num, float(
-                    revised_YIN_List[mfcc_line_count][2]), frame_count) + tuple(segment_mfcc))
-                mfcc_line_count += 1
+    pitch_file, mel_file, clips_file = frame_store_files(outfile_1)
+    identity = frame_store_identity(folder_name, extension)
+    if len(identity) == 1:
+        sys.exit("No files in folder \"" + folder_name + "\" has supported audio file extesion")
 
-            if mfcc_line_count == line_count:
-                break
+    if all(os.path.exists(store_file) for store_file in (clips_file, pitch_file, mel_file)) and \
+            np.array_equal(np.load(clips_file), identity):
+        print("Frame store reused:", len(identity) - 1, "clips")
+    else:
+        Build_Frame_Store(folder_name, extension, pitch_file, mel_file)
+        np.save(clips_file, identity)
+        print("Frame store built:", len(identity) - 1, "clips")
+
+    YIN_table, MFCC_table, tot_segments = resegment_frame_store(pitch_file, mel_file, SEGMENT_LENGTH)
+    table_write(YIN_table, outfile_1)
+    table_write(MFCC_table, outfile_2)
+    print("Segments cut from the frame store:", tot_segments, "of", SEGMENT_LENGTH, "seconds")
+    return tot_segments
+
+
+# Function to decide whether a segment is voiced from its voicing statistics
+def is_voiced(pitch_rate, pitch_mu, pitch_sigma):
+    return pitch_rate >= PITCH_RATE_LOWER and \
+        pitch_mu >= PITCH_MU_LOWER and pitch_mu <= PITCH_MU_UPPER and pitch_sigma <= PITCH_SIGMA_UPPER
+
+
+# Function to calculate the voicing statistics of a block of segments from their YIN pitch tracks, stacked in the
+# rows of 'pitch' and padded with NaN beyond 'lengths': the fraction of frames with a human pitch, and the mean and
+# the standard deviation of those pitches, as arrays
+def block_pitch_statistics(pitch, lengths):
+    pitch = np.asarray(pitch, dtype=np.float64)
+    in_band = (pitch >= PITCH_HUMAN_LOWER) & (pitch <= PITCH_HUMAN_UPPER)
+    c = np.count_nonzero(in_band, axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pitch_rate = np.where(c != 0, c / np.maximum(lengths, 1), 0.0)
+        pitch_mu = np.where(c != 0, np.sum(np.where(in_band, pitch, 0.0), axis=1) / c, 0.0)
+        deviation = np.where(in_band, pitch - pitch_mu[:, None], 0.0)
+        pitch_sigma = np.where(c != 0, np.sqrt(np.sum(deviation * deviation, axis=1) / (c - 1)), 0.0)
+
+    return pitch_rate, pitch_mu, pitch_sigma
+
+
+# Function to decide which segments of a block are voiced from their voicing statistics
+# The floating point mean and standard deviation may round differently from the exact ones of the statistics module,
+# so the segments lying within VOICING_TOLERANCE of a threshold are decided again with the exact ones
+def block_voiced(pitch, lengths):
+    pitch_rate, pitch_mu, pitch_sigma = block_pitch_statistics(pitch, lengths)
+    voiced = (pitch_rate >= PITCH_RATE_LOWER) & (pitch_mu >= PITCH_MU_LOWER) & (pitch_mu <= PITCH_MU_UPPER) & \
+        (pitch_sigma <= PITCH_SIGMA_UPPER)
+
+    borderline = (pitch_rate >= PITCH_RATE_LOWER) & (
+        np.isclose(pitch_mu, PITCH_MU_LOWER, rtol=VOICING_TOLERANCE, atol=0) |
+        np.isclose(pitch_mu, PITCH_MU_UPPER, rtol=VOICING_TOLERANCE, atol=0) |
+        np.isclose(pitch_sigma, PITCH_SIGMA_UPPER, rtol=VOICING_TOLERANCE, atol=0))
+    for i in np.flatnonzero(borderline):
+        segment_pitch_i = np.asarray(pitch[i][:lengths[i]], dtype=np.float64)
+        human_pitch = segment_pitch_i[(segment_pitch_i >= PITCH_HUMAN_LOWER) &
+                                      (segment_pitch_i <= PITCH_HUMAN_UPPER)].tolist()
+        pitch_mu[i] = statistics.mean(human_pitch)
+        voiced[i] = is_voiced(pitch_rate[i], pitch_mu[i], statistics.stdev(human_pitch))
+
+    return voiced, pitch_mu
 
-        file_write(revised_MFCC_List, out_file)
 
-    f.close()
+# Function to Remove Non-voiced Segments
+def Remove_Non_Voiced(in_file1, in_file2, out_file):
+    revised_MFCC_table = select_voiced_segments(feature_io.read_feature_file(in_file1),
+                                                feature_io.read_feature_file(in_file2))
+    line_count = len(revised_MFCC_table.header)
+    if line_count == 0:
+        return line_count
+
+    table_write(revised_MFCC_table, out_file)
     return line_count
 
 
-# Function to calculate the column mean of an MFCC matrix
+# Function to select the voiced segments from the YIN and MFCC feature tables (see feature_io) of the segments
+# The pitch tracks are processed VOICING_BLOCK segments at a time
+# Returns the feature table of the voiced segments, with their mean pitch and frame count, and their MFCCs
+# The frame count of a segment is the length of its MFCC row, which differs between clips analysed at different rates
+def select_voiced_segments(YIN_table, MFCC_table):
+    voiced = np.zeros(len(YIN_table.header), dtype=bool)
+    pitch_mu = np.zeros(len(YIN_table.header))
+    for start in range(0, len(YIN_table.header), VOICING_BLOCK):
+        pitch, lengths = feature_io.feature_matrix(YIN_table, start, start + VOICING_BLOCK)
+        voiced[start:start + VOICING_BLOCK], pitch_mu[start:start + VOICING_BLOCK] = block_voiced(pitch, lengths)
+
+    # Look up the voiced segments among the MFCC rows by their (audio number, segment number) key
+    yin_keys = segment_keys(YIN_table.header)
+    mfcc_keys = segment_keys(MFCC_table.header)
+    is_voiced_row = np.isin(mfcc_keys, yin_keys[voiced])
+    voiced_pitch_mu = dict(zip(yin_keys[voiced].tolist(), pitch_mu[voiced].tolist()))
+
+    header = MFCC_table.header[is_voiced_row]
+    columns = (header['audio_num'], header['segment_num'],
+               [voiced_pitch_mu[key] for key in mfcc_keys[is_voiced_row].tolist()], header['length'] // (n_mfcc - 1))
+    mfcc, lengths = feature_io.feature_matrix(MFCC_table)
+    if np.all(lengths == mfcc.shape[1]):
+        return feature_io.matrix_table(columns, mfcc[is_voiced_row], feature_io.VOICED_SEGMENT_FIELDS)
+    return feature_io.segment_table(columns, [x[:length] for x, length in zip(mfcc[is_voiced_row],
+                                                                             lengths[is_voiced_row])],
+                                    feature_io.VOICED_SEGMENT_FIELDS)
+
+
+# Function to combine the audio and segment numbers of the header records of a feature table into a single key
+def segment_keys(header):
+    return (np.asarray(header['audio_num'], dtype=np.int64) << 32) | np.asarray(header['segment_num'], dtype=np.int64)
+
+
+# Function to summarize a voiced segment tuple, whose MFCCs are listed frame by frame as in the rev.MFCC file,
+# by the column sums of its MFCC matrix
 # Order of MFCC representation is (num_frames,n_fft)
 # MFCC is represented as an 1-D array obtained by appending
 # 'num_frame' rows of size 'n_fft' placed side-by-side
 # Number of MFCCs is (n_mfcc - 1) due to deselection of the first coefficient
-def get_column_mean(mfcc):
-    column_mean_arr = []
+# Merging two summarized segments adds up their column sums, instead of appending their MFCC matrices
+def segment_statistics(item):
+    mfcc = np.asarray(item[4:], dtype=np.float64).reshape(-1, n_mfcc - 1)
+    return tuple(item[:4]) + tuple(np.sum(mfcc, axis=0).tolist())
+
+
+# Function to find the MFCC column sums of every segment of a voiced segment feature table (see feature_io), as
+# segment_statistics does, STATISTICS_BLOCK segments at a time
+def segment_sums(MFCC_table):
     n_columns = n_mfcc - 1
+    mfcc_sum = np.zeros((len(MFCC_table.header), n_columns))
+    for start in range(0, len(MFCC_table.header), STATISTICS_BLOCK):
+        mfcc, lengths = feature_io.feature_matrix(MFCC_table, start, start + STATISTICS_BLOCK)
+        if np.all(lengths == mfcc.shape[1]):
+            mfcc_sum[start:start + len(mfcc)] = \
+                np.asarray(mfcc, dtype=np.float64).reshape(len(mfcc), -1, n_columns).sum(axis=1)
+        else:
+            for i, (x, length) in enumerate(zip(mfcc, lengths)):
+                mfcc_sum[start + i] = np.asarray(x[:length], dtype=np.float64).reshape(-1, n_columns).sum(axis=0)
+    return mfcc_sum
 
-    for i in range(n_columns):
-        column = []
-        for j in range(i, len(mfcc), n_columns):
-            column.append(mfcc[j])
 
-        # print(len(column))
-        column_mean = np.mean(column)
-        column_mean_arr.append(column_mean)
+# Function to build the feature table of summarized segments, from the columns of their header fields and their
+# MFCC column sums
+def statistics_table(audio_num, segment_num, pitch, frame_count, mfcc_sum):
+    return feature_io.matrix_table((audio_num, segment_num, pitch, frame_count), mfcc_sum,
+                                   feature_io.VOICED_SEGMENT_FIELDS, feature_io.SUM_TYPE)
 
-    return column_mean_arr
 
+# Function to add up the MFCC column sums of two summarized segments
+def add_statistics(mfcc_sum_p, mfcc_sum_q):
+    return tuple(x + y for x, y in zip(mfcc_sum_p, mfcc_sum_q))
 
-# Function to find Distance (in degrees) between input MFCC matrices
-def get_Distance(mfcc1, mfcc2):
-    # Get aveage MFCC vector for the segment pair using column mean of the input matrices
-    mfcc_a = get_column_mean(mfcc1)
-    mfcc_b = get_column_mean(mfcc2)
 
-    cosine_distance = np.dot(mfcc_a, mfcc_b) / (la.norm(mfcc_a) * la.norm(mfcc_b))
-    # cosine_distance = distance.cosine(mfcc_a, mfcc_b)
+# Function to calculate the column mean of an MFCC matrix from its column sums and its number of frames
+def get_column_mean(mfcc_sum, frame_count):
+    return np.asarray(mfcc_sum) / frame_count
 
-    radian_distance = math.acos(cosine_distance)
-    # print("Radian Distance:", radian_distance)
 
-    degree_distance = math.degrees(radian_distance)
-    # print("Degree Distance:", degree_distance)
+# Function to find Distance (in degrees) between the average MFCC vectors (column means) of two segments
+def get_Distance(mfcc_a, mfcc_b):
+    return cluster_engine.vector_angle(mfcc_a, mfcc_b)
 
-    return degree_distance
 
+# Function to merge two neighbor segments, summarized by segment_statistics, if they match
+# Returns the merged segment, or None if the segments do not match
+def merge_neighbors(item_p, item_q):
+    audio_num_p = item_p[0]
+    segment_num_p = item_p[1]
+    segment_pitch_p = item_p[2]
+    segment_frame_count_p = item_p[3]
+    mfcc_p = item_p[4:]
 
-# Function to merge matching neighbor segments
-def merge_segments(revised_ceptral_file, merged_ceptral_file):
-    MFCC_List = []
+    # audio_num_q = item_q[0]
+    # segment_num_q = item_q[1]
+    segment_pitch_q = item_q[2]
+    segment_frame_count_q = item_q[3]
+    mfcc_q = item_q[4:]
 
-    with open(revised_ceptral_file, "r") as f:
-        csv_reader = csv.reader(f, delimiter=',')
+    distance = get_Distance(get_column_mean(mfcc_p, segment_frame_count_p),
+                            get_column_mean(mfcc_q, segment_frame_count_q))
+    decision = gender_decision(segment_pitch_p, segment_pitch_q)
 
-        mfcc_line_count = 0
+    if distance <= MFCC_DIST_SAME_UN and decision == 1:
+        revised_audio_num_p = audio_num_p
+        revised_segment_num_p = segment_num_p
+        revised_segment_pitch_p = (segment_pitch_p + segment_pitch_q) / 2
+        revised_segment_frame_count_p = segment_frame_count_p + segment_frame_count_q
+        revised_mfcc_p = add_statistics(mfcc_p, mfcc_q)
 
-        for row in csv_reader:
-            curr_audio_num = int(row[0])
-            curr_segment_num = int(row[1])
-            curr_segment_pitch = float(row[2])
-            curr_segment_frame_count = int(row[3])
-            segment_mfcc_str = np.array(row[4:])
-            segment_mfcc = segment_mfcc_str.astype(float)
+        return (revised_audio_num_p, revised_segment_num_p, revised_segment_pitch_p,
+                revised_segment_frame_count_p) + tuple(revised_mfcc_p)
+    return None
 
-            MFCC_List.append(
-                (curr_audio_num, curr_segment_num, curr_segment_pitch, curr_segment_frame_count) + tuple(segment_mfcc))
-            mfcc_line_count += 1
 
-    f.close()
+# Function to merge matching neighbor segments
+# With "--angle-matrix", the angle matrix of the voiced segments is built first, next to the merged feature file
+def merge_segments(revised_ceptral_file, merged_ceptral_file):
+    MFCC_table = feature_io.read_feature_file(revised_ceptral_file)
+    mfcc_sum = segment_sums(MFCC_table)
+    segment_angles = None
+    if angle_matrix_budget is not None:
+        temp_folder = os.path.dirname(merged_ceptral_file)
+        segment_angles = Build_Angle_Matrix(MFCC_table.header, mfcc_sum,
+                                            os.path.join(temp_folder, 'angle' + feature_file_extension),
+                                            os.path.join(temp_folder, 'gender' + feature_file_extension),
+                                            angle_matrix_budget)
+    merged_table = merge_neighbor_segments(MFCC_table, segment_angles, mfcc_sum)
+
+    table_write(merged_table, merged_ceptral_file)
+    # print("Size of Segment List after merging Matching Segments:", len(merged_table.header), "\n")
+    return merged_table
+
+
+# Function to merge matching neighbor segments of a voiced segment feature table (see feature_io)
+# The angles of the first merging pass are looked up in 'segment_angles' (see Build_Angle_Matrix) when given, and
+# the MFCC column sums of the segments are taken from 'mfcc_sum' when given
+# Returns the feature table of the merged segments, summarized by their MFCC column sums, holding the same
+# segments as merge_neighbor_segments_pairwise
+def merge_neighbor_segments(MFCC_table, segment_angles=None, mfcc_sum=None):
+    header = MFCC_table.header
+    if mfcc_sum is None:
+        mfcc_sum = segment_sums(MFCC_table)
+    if len(header) == 0:
+        return statistics_table([], [], [], [], mfcc_sum)
+
+    angles, decisions = segment_angles if segment_angles is not None else (None, None)
+    remaining, mfcc_sum, frame_count, pitch = cluster_engine.merge_neighbor_runs(
+        mfcc_sum, header['frame_count'], header['pitch'], MFCC_DIST_SAME_UN, PITCH_MALE_UPPER, PITCH_FEMALE_LOWER,
+        angles, decisions)
+
+    return statistics_table(header['audio_num'][remaining], header['segment_num'][remaining], pitch, frame_count,
+                            mfcc_sum)
+
+
+# Function to build the angle matrix of the voiced segments, given by the header records of their feature table and
+# their MFCC column sums: the angles (in degrees, float32) between the average MFCC vectors of all the segment
+# pairs, written to 'angle_file', and their gender decisions (int8, as gender_decision), written to 'gender_file',
+# both as memory-mapped .npy files of shape (segments, segments)
+# The matrices are computed in blocks of rows fitting in 'memory_budget' megabytes, and can be inspected offline
+# Returns the SegmentAngles of the files
+def Build_Angle_Matrix(header, mfcc_sum, angle_file, gender_file, memory_budget):
+    segment_count = len(header)
+    mfcc_mean = mfcc_sum / np.asarray(header['frame_count'])[:, None]
+
+    angles = np.lib.format.open_memmap(angle_file, mode='w+', dtype=np.float32, shape=(segment_count, segment_count))
+    decisions = np.lib.format.open_memmap(gender_file, mode='w+', dtype=np.int8, shape=(segment_count, segment_count))
+    block_rows = max(1, int(memory_budget * 2 ** 20 // (ANGLE_MATRIX_PAIR_BYTES * max(segment_count, 1))))
+    same_count, diff_count = cluster_engine.angle_matrix(mfcc_mean, header['pitch'], angles, decisions, block_rows,
+                                                         MFCC_DIST_SAME_UN, MFCC_DIST_DIFF_UN,
+                                                         PITCH_MALE_UPPER, PITCH_FEMALE_LOWER)
+    angles.flush()
+    decisions.flush()
+
+    pair_count = segment_count * (segment_count - 1) // 2
+    print("Voiced segment pairs:", pair_count, "within", MFCC_DIST_SAME_UN, "degrees:", same_count,
+          "at least", MFCC_DIST_DIFF_UN, "degrees apart:", diff_count)
+    return SegmentAngles(angles, decisions)
+
+
+# Function to load the angle matrix written by Build_Angle_Matrix, memory-mapping its files
+def read_angle_matrix(angle_file, gender_file):
+    return SegmentAngles(np.load(angle_file, mmap_mode='r'), np.load(gender_file, mmap_mode='r'))
+
+
+# Function to merge matching neighbor segments of a list of voiced segment tuples, pair by pair
+# Reference implementation of merge_neighbor_segments, returning the merged segments as tuples
+def merge_neighbor_segments_pairwise(MFCC_List):
+    MFCC_List = [segment_statistics(item) for item in MFCC_List]
 
     # iteratively pre-cluster the neighbor segments until no merging happens
     while True:
@@ -387,33 +1443,10 @@ def merge_segments(revised_ceptral_file, merged_ceptral_file):
         q = 1
 
         while q < len(MFCC_List):
-            item_p = MFCC_List[p]
-            audio_num_p = item_p[0]
-            segment_num_p = item_p[1]
-            segment_pitch_p = item_p[2]
-            segment_frame_count_p = item_p[3]
-            mfcc_p = item_p[4:]
-
-            item_q = MFCC_List[q]
-            # audio_num_q = item_q[0]
-            # segment_num_q = item_q[1]
-            segment_pitch_q = item_q[2]
-            segment_frame_count_q = item_q[3]
-            mfcc_q = item_q[4:]
-
-            distance = get_Distance(mfcc_p, mfcc_q)
-            decision = gender_decision(segment_pitch_p, segment_pitch_q)
+            revised_item_p = merge_neighbors(MFCC_List[p], MFCC_List[q])
 
             # print("p:", p, "q:", q,"Cosine Distance:", distance)
-            if distance <= MFCC_DIST_SAME_UN and decision == 1:
-                revised_audio_num_p = audio_num_p
-                revised_segment_num_p = segment_num_p
-                revised_segment_pitch_p = (segment_pitch_p + segment_pitch_q) / 2
-                revised_segment_frame_count_p = segment_frame_count_p + segment_frame_count_q
-                revised_mfcc_p = mfcc_p + mfcc_q
-
-                revised_item_p = (revised_audio_num_p, revised_segment_num_p, revised_segment_pitch_p,
-                                  revised_segment_frame_count_p) + tuple(revised_mfcc_p)
+            if revised_item_p is not None:
                 MFCC_List[p] = revised_item_p
 
                 MFCC_List.pop(q)
@@ -424,21 +1457,246 @@ def merge_segments(revised_ceptral_file, merged_ceptral_file):
         if last_size == len(MFCC_List):
             break
 
-    file_write(MFCC_List, merged_ceptral_file)
-    # print("Size of Segment List after merging Matching Segments:", last_size, "\n")
     return MFCC_List
 
 
+# Function to compare a merged segment with every admitted speaker, both summarized by segment_statistics:
+# the segment is merged into the first
+# matching speaker, or admitted as a new speaker if it differs from all of them
+# Returns the updated speaker count
+def admit_segment(new_mfcc_list, i, segment):
+    speaker_count = len(new_mfcc_list)
+    diff_count = 0
+    pitch = segment[2]
+    frame_count = segment[3]
+    mfcc = segment[4:]
+
+    for j in range(speaker_count):
+        # print("i =", i, "j =", j, "List Size =", len(mfcc_list), "Current Speaker Count:", speaker_count)
+        # for each segment i, compare it with each previously admitted segment j
+
+        new_audio_num = new_mfcc_list[j][0]
+        new_segment_num = new_mfcc_list[j][1]
+        new_pitch = new_mfcc_list[j][2]
+        new_frame_count = new_mfcc_list[j][3]
+        new_mfcc = new_mfcc_list[j][4:]
+
+        decision = gender_decision(new_pitch, pitch)
+        distance = get_Distance(get_column_mean(new_mfcc, new_frame_count), get_column_mean(mfcc, frame_count))
+
+        print("i =", i, "j =", j, "Decision:", decision,
+              "Distance:", distance, "Diff Count:", diff_count, "Current Speaker Count:", speaker_count)
+
+        # different gender observed from pitch, so different speaker
+        if decision == 0:
+            diff_count += 1
+        # mfcc distance is larger than a threshold, so different speaker
+        elif distance >= MFCC_DIST_DIFF_UN:
+            diff_count += 1
+        # same speaker
+        else:
+            if decision == 1 and distance <= MFCC_DIST_SAME_UN:
+                # Merge the segment
+                # new_pitch = (new_pitch + pitch) / 2
+                new_frame_count = new_frame_count + frame_count
+                new_pitch = (new_pitch * new_frame_count + pitch * frame_count) / (new_frame_count + frame_count)
+                new_mfcc = add_statistics(new_mfcc, mfcc)
+
+                new_item = (new_audio_num, new_segment_num, new_pitch, new_frame_count) + tuple(new_mfcc)
+                new_mfcc_list[j] = new_item
+                break
+
+        # print("i =", i, "j =", j, "Decision:", decision,
+        #       "Distance:", distance, "Diff Count:", diff_count, "Current Speaker Count:", speaker_count)
+
+    print("Diff Count:", diff_count)
+    # admit as a new speaker if different from all the admitted speakers
+    if diff_count == speaker_count:
+        speaker_count += 1
+        # new_audio_num = segment[0]
+        # new_segment_num = segment[1]
+        # new_pitch = segment[2]
+        # new_frame_count = segment[3]
+        # new_mfcc = segment[4:]
+        new_mfcc_list.append(segment)
+
+    return speaker_count
+
+
+# Function to admit the speakers of a feature table of merged segments (see merge_neighbor_segments): the first
+# segment is admitted as speaker 1, and every following segment is merged into a matching speaker or admitted as
+# a new one
+# Compares each segment with all the admitted speakers at once (see cluster_engine)
+# With 'speaker_table', the feature table of the speakers admitted from the merged segments before these ones,
+# the admission carries on from those speakers instead of admitting the first segment
+# Returns the feature table of the admitted speakers, holding the same speakers as admit_speakers_pairwise
+def admit_speakers(merged_table, speaker_table=None):
+    header = merged_table.header
+    mfcc_sum = np.reshape(merged_table.values, (len(header), n_mfcc - 1))
+    if speaker_table is None:
+        speaker_table = statistics_table([], [], [], [], np.zeros((0, n_mfcc - 1)))
+    if len(header) == 0:
+        return speaker_table
+
+    speaker_header = speaker_table.header
+    speakers = (np.reshape(speaker_table.values, (len(speaker_header), n_mfcc - 1)), speaker_header['frame_count'],
+                speaker_header['pitch'])
+    speaker_segment, mfcc_sum, frame_count, pitch = cluster_engine.admit_speaker_runs(
+        mfcc_sum, header['frame_count'], header['pitch'], MFCC_DIST_SAME_UN, MFCC_DIST_DIFF_UN, PITCH_MALE_UPPER,
+        PITCH_FEMALE_LOWER, speakers)
+
+    # the speakers admitted before keep their rows, the new ones are opened by segments of 'merged_table'
+    new_segment = speaker_segment[len(speaker_header):]
+    return statistics_table(np.concatenate((speaker_header['audio_num'], header['audio_num'][new_segment])),
+                            np.concatenate((speaker_header['segment_num'], header['segment_num'][new_segment])),
+                            pitch, frame_count, mfcc_sum)
+
+
+# Function to admit the speakers of a list of merged segment tuples, comparing each segment with one speaker at a
+# time
+# Reference implementation of admit_speakers, returning the admitted speakers as tuples
+def admit_speakers_pairwise(mfcc_list):
+    new_mfcc_list = []
+    if len(mfcc_list) == 0:
+        return new_mfcc_list
+
+    new_mfcc_list.append(mfcc_list[0])
+    for i in range(1, len(mfcc_list)):
+        admit_segment(new_mfcc_list, i, mfcc_list[i])
+    return new_mfcc_list
+
+
+# Function to stream the voiced segments of the supported audio clips in a folder, clip by clip, as
+# (audio number, segment number, mean pitch, frame count) + MFCCs tuples, the rows of the rev.MFCC file
+# Only one segment of a clip (see read_clip_segments) and one block of segments are held in memory; 'counts'
+# accumulates the segment counts
+def voiced_segment_stream(folder_name, extension, counts):
+    if not os.listdir(folder_name):
+        sys.exit("No file in folder \"" + folder_name + "\"")
+
+    file_count = 0
+    for file in os.listdir(folder_name):
+        if file.endswith(extension):
+            file_count += 1
+            sr, segments = read_clip_segments(folder_name + f"/{file}", SEGMENT_LENGTH)
+
+            segment_count = 0
+            for f0, voiced, segment_mfcc in segment_features(segments, sr):
+                segment_count += 1
+                counts["segments"] += 1
+                if len(f0) == 0:
+                    counts["gate_skipped"] += 1
+                if segment_mfcc is None:
+                    counts["mfcc_avoided"] += 1
+                if not voiced:
+                    continue
+
+                counts["voiced"] += 1
+                pitch_mu = float(block_voiced(f0[None], [len(f0)])[1][0])
+                # Deselect the first coefficient, and list the MFCCs frame by frame (as in the MFCC file)
+                segment_mfcc_tr = segment_mfcc[1:].transpose()
+                yield (file_count, segment_count, pitch_mu, len(segment_mfcc_tr)) + \
+                    tuple(segment_mfcc_tr.ravel().tolist())
+
+    if file_count == 0:
+        sys.exit("No files in folder \"" + folder_name + "\" has supported audio file extesion")
+
+
+# Function to merge matching neighbor segments of a stream of segments, yielding them summarized by
+# segment_statistics, the same as merge_neighbor_segments_pairwise
+# Each pass of merge_neighbor_segments_pairwise is run as a stage holding the segment absorbing its right
+# neighbors, and passing it on to the next stage once a neighbor does not match. The stage of the next pass is
+# only needed once the last stage merges; it then starts from the last segment that stage passed on, as the next
+# pass would have reached it without a merge. Merged segments are held back until 'window' segments follow them,
+# for those new stages: the result is exact as long as the merging takes at most 'window' + 1 passes
+def merge_segment_stream(segments, window=MERGE_WINDOW):
+    held = [None]
+    merged = deque()
+
+    # Function to pass 'item' to the stage of pass 'stage'
+    def pass_on(stage, item):
+        while True:
+            if held[stage] is None:
+                held[stage] = item
+                return
+            revised_item = merge_neighbors(held[stage], item)
+            if revised_item is not None:
+                held[stage] = revised_item
+                if stage == len(held) - 1:
+                    held.append(merged.pop() if merged else None)
+                return
+            held[stage], item = item, held[stage]
+            if stage == len(held) - 1:
+                merged.append(item)
+                return
+            stage += 1
+
+    for item in segments:
+        pass_on(0, segment_statistics(item))
+        while len(merged) > window:
+            yield merged.popleft()
+
+    # flush the stages in the order of their passes, as each may still merge in the following ones
+    stage = 0
+    while stage < len(held):
+        item, held[stage] = held[stage], None
+        if item is not None:
+            if stage == len(held) - 1:
+                merged.append(item)
+            else:
+                pass_on(stage + 1, item)
+        stage += 1
+    yield from merged
+
+
+# Function to count the speakers of the audio clips in a folder in one streaming pass
+# The merged segments are admitted ADMISSION_BLOCK at a time by admit_speakers, carrying on from the speakers
+# admitted from the previous blocks
+# Returns the same counts as count_speaker
+def count_speaker_streaming(speech_folder, audio_extension, new_cept_file):
+    counts = {"segments": 0, "voiced": 0, "gate_skipped": 0, "mfcc_avoided": 0}
+    speaker_table = None
+    mfcc_list_size = 0
+
+    merged_block = []
+    for segment in merge_segment_stream(voiced_segment_stream(speech_folder, audio_extension, counts)):
+        merged_block.append(segment)
+        mfcc_list_size += 1
+        if len(merged_block) == ADMISSION_BLOCK:
+            speaker_table = admit_speakers(feature_io.feature_table(merged_block, feature_io.VOICED_SEGMENT_FIELDS,
+                                                                    feature_io.SUM_TYPE), speaker_table)
+            merged_block = []
+    if len(merged_block) != 0:
+        speaker_table = admit_speakers(feature_io.feature_table(merged_block, feature_io.VOICED_SEGMENT_FIELDS,
+                                                                feature_io.SUM_TYPE), speaker_table)
+    speaker_count = 0 if speaker_table is None else len(speaker_table.header)
+
+    if energy_gate:
+        print("Segments skipped by the energy gate:", counts["gate_skipped"], "of", counts["segments"])
+    print("MFCC computations avoided for non-voiced segments:", counts["mfcc_avoided"], "of", counts["segments"])
+    print("Segment:", counts["segments"], "Voiced Segments:", counts["voiced"])
+
+    if speaker_count != 0:
+        table_write(speaker_table, new_cept_file)
+    return speaker_count, counts["segments"], counts["voiced"], mfcc_list_size
+
+
 # The main function for Unsupervised Speaker Counting from a given set of speech files
-def count_speaker(speech_folder, audio_extension, pitch_file, cept_file, rev_cept_file, merged_cept_file):
+# The admitted speakers are written to 'new_cept_file', by default the new.MFCC file next to 'merged_cept_file'
+def count_speaker(speech_folder, audio_extension, pitch_file, cept_file, rev_cept_file, merged_cept_file,
+                  new_cept_file=None):
+    if new_cept_file is None:
+        new_cept_file = os.path.join(os.path.dirname(merged_cept_file), 'new.MFCC' + feature_file_extension)
+    if streaming:
+        return count_speaker_streaming(speech_folder, audio_extension, new_cept_file)
+
     # Split each audio file (having supported extension) in speech folder into segments (of equal duration)
     # Generate Pitch and MFCC features for each segment
     # and save these feature vectors/matrices in corresponding feature files for further processing
-    num_segments, segment_frame_count = \
-        Generate_Feature_Files(speech_folder, audio_extension, pitch_file, cept_file)
+    num_segments = Generate_Feature_Files(speech_folder, audio_extension, pitch_file, cept_file)
 
     # Remove non-voiced audio segments from the list using generated Pitch and MFCC features
-    num_voiced_segments = Remove_Non_Voiced(pitch_file, cept_file, segment_frame_count, rev_cept_file)
+    num_voiced_segments = Remove_Non_Voiced(pitch_file, cept_file, rev_cept_file)
 
     print("Segment:", num_segments, "Voiced Segments:", num_voiced_segments)
 
@@ -453,84 +1711,123 @@ def count_speaker(speech_folder, audio_extension, pitch_file, cept_file, rev_cep
 
 
     # Iteratively merge matching neighboring voice segments in the list
-    mfcc_list = merge_segments(rev_cept_file, merged_cept_file)
-    mfcc_list_size = len(mfcc_list)
+    mfcc_table = merge_segments(rev_cept_file, merged_cept_file)
+    mfcc_list_size = len(mfcc_table.header)
 
-    new_mfcc_list = []
-    new_mfcc_list.append(mfcc_list[0])
+    new_mfcc_table = admit_speakers(mfcc_table)
+    speaker_count = len(new_mfcc_table.header)
 
-    # new_audio_num = mfcc_list[0][0]
-    # new_segment_num = mfcc_list[0][1]
-    #
-    # new_pitch = mfcc_list[0][2]
-    # new_frame_count = mfcc_list[0][3]
-    # new_mfcc = mfcc_list[0][4:]
-
-    # print("\n")
-    for i in range(1, mfcc_list_size):
-        diff_count = 0
-        pitch = mfcc_list[i][2]
-        frame_count = mfcc_list[i][3]
-        mfcc = mfcc_list[i][4:]
-
-        for j in range(speaker_count):
-            # print("i =", i, "j =", j, "List Size =", len(mfcc_list), "Current Speaker Count:", speaker_count)
-            # for each segment i, compare it with each previously admitted segment j
-
-            new_audio_num = new_mfcc_list[j][0]
-            new_segment_num = new_mfcc_list[j][1]
-            new_pitch = new_mfcc_list[j][2]
-            new_frame_count = new_mfcc_list[j][3]
-            new_mfcc = new_mfcc_list[j][4:]
-
-            decision = gender_decision(new_pitch, pitch)
-            distance = get_Distance(new_mfcc, mfcc)
-
-            print("i =", i, "j =", j, "Decision:", decision,
-                  "Distance:", distance, "Diff Count:", diff_count, "Current Speaker Count:", speaker_count)
-
-            # different gender observed from pitch, so different speaker
-            if decision == 0:
-                diff_count += 1
-            # mfcc distance is larger than a threshold, so different speaker
-            elif distance >= MFCC_DIST_DIFF_UN:
-                diff_count += 1
-            # same speaker
-            else:
-                if decision == 1 and distance <= MFCC_DIST_SAME_UN:
-                    # Merge the segment
-                    # new_pitch = (new_pitch + pitch) / 2
-                    new_frame_count = new_frame_count + frame_count
-                    new_pitch = (new_pitch * new_frame_count + pitch * frame_count) / (new_frame_count + frame_count)
-                    new_mfcc = new_mfcc + mfcc
-
-                    new_item = (new_audio_num, new_segment_num, new_pitch, new_frame_count) + tuple(new_mfcc)
-                    new_mfcc_list[j] = new_item
-                    break
-
-            # print("i =", i, "j =", j, "Decision:", decision,
-            #       "Distance:", distance, "Diff Count:", diff_count, "Current Speaker Count:", speaker_count)
-
-        print("Diff Count:", diff_count)
-        # admit as a new speaker if different from all the admitted speakers
-        if diff_count == speaker_count:
-            speaker_count += 1
-            # new_audio_num = mfcc_list[i][0]
-            # new_segment_num = mfcc_list[i][1]
-            # new_pitch = mfcc_list[i][2]
-            # new_frame_count = mfcc_list[i][3]
-            # new_mfcc = mfcc_list[i][4:]
-            new_mfcc_list.append(mfcc_list[i])
-
-    file_write(new_mfcc_list, new_mfcc_file)
+    table_write(new_mfcc_table, new_cept_file)
     return speaker_count, num_segments, num_voiced_segments, mfcc_list_size
 
 
+# Counts of speakers and segments, and feature tables (see feature_io) of every stage of the pipeline,
+# as returned by count_speakers
+SpeakerCount = namedtuple('SpeakerCount', ['speaker_count', 'total_segments', 'voiced_segments', 'merged_segments',
+                                           'pitch', 'mfcc', 'voiced', 'merged', 'speakers'])
+
+
+# Function to count the speakers of a list of audio clips, given as file paths or as (samples, sampling rate)
+# pairs, without any temporary file
+# The keyword parameters override the options of the module (see configure) for this call only; None keeps them
+# Returns a SpeakerCount; with 'persist_folder', the feature tables are also written there as feature files
+def count_speakers(clips, persist_folder=None, segment_length=None, features=None, analysis_rate=None, yin_rate=None,
+                   energy_gate=None, decoder=None, same_distance=None, diff_distance=None):
+    with configured(segment_length=segment_length, features=features, analysis_rate=analysis_rate,
+                    yin_rate=yin_rate, energy_gate=energy_gate, decoder=decoder, same_distance=same_distance,
+                    diff_distance=diff_distance):
+        return count_configured_speakers(clips, persist_folder)
+
+
+# Function to count the speakers of a list of audio clips with the options of the module, for count_speakers
+def count_configured_speakers(clips, persist_folder):
+    YIN_tables = []
+    MFCC_tables = []
+    tot_segments = 0
+
+    for file_count, clip in enumerate(clips, 1):
+        if isinstance(clip, str):
+            clip = load_clip(clip)
+        samples, native_rate = clip
+
+        segment_count, mfcc_avoided, gate_skipped, YIN_table, MFCC_table = \
+            clip_features(file_count, np.asarray(samples), native_rate, SEGMENT_LENGTH)
+        YIN_tables.append(YIN_table)
+        MFCC_tables.append(MFCC_table)
+        tot_segments += segment_count
+
+    # the pitch tracks are not rounded to the single precision of the feature files for the voiced selection
+    YIN_table = feature_io.concatenate_tables(YIN_tables, feature_io.SEGMENT_FIELDS, np.float64)
+    MFCC_table = feature_io.concatenate_tables(MFCC_tables, feature_io.SEGMENT_FIELDS)
+    voiced_table = select_voiced_segments(YIN_table, MFCC_table)
+    merged_table = merge_neighbor_segments(voiced_table)
+    speaker_table = admit_speakers(merged_table)
+
+    YIN_table = feature_io.FeatureTable(YIN_table.header, YIN_table.values.astype(feature_io.VALUE_TYPE))
+    stages = (('YIN', YIN_table), ('MFCC', MFCC_table), ('rev.MFCC', voiced_table), ('merged.MFCC', merged_table),
+              ('new.MFCC', speaker_table))
+    if persist_folder is not None:
+        if os.path.exists(persist_folder) is False:
+            os.makedirs(persist_folder)
+        for name, table in stages:
+            table_write(table, os.path.join(persist_folder, name + feature_file_extension))
+
+    return SpeakerCount(len(speaker_table.header), tot_segments, len(voiced_table.header), len(merged_table.header),
+                        *[table for name, table in stages])
+
+
 # Call the main function
 def main():
+    parser = argparse.ArgumentParser(
+        description="Find the number of different speakers identifiable in the audio clips of a speech folder")
+    parser.add_argument("speech_folder", nargs="?", help="folder of the recorded clips")
+    parser.add_argument("same_distance", nargs="?", type=float,
+                        help="tuning parameter 1: MFCC distance below which segments may be of the same speaker")
+    parser.add_argument("diff_distance", nargs="?", type=float,
+                        help="tuning parameter 2: MFCC distance from which segments are of different speakers")
+    parser.add_argument("--check-features", action="store_true", default=None,
+                        help="compare the feature backend with the librosa backend instead of counting speakers")
+    add_options(parser)
+    arguments = parser.parse_args()
+    # the tuning parameters are only taken together
+    if arguments.diff_distance is None:
+        arguments.same_distance = None
+    try:
+        configure(**parsed_options(arguments))
+    except ValueError as error:
+        parser.error(str(error))
+
+    speech_folder_name = arguments.speech_folder
+    if speech_folder_name is None:
+        exit("\nPlease include recorded clips in a directory and\n" + "pass the directory path as command line argument")
+
+    if os.path.exists(speech_folder_name) is False:
+        sys.exit("\nFolder \"" + speech_folder_name + "\" not found. Check the Speech folder path")
+
+    if check_features:
+        passed = True
+        for file in os.listdir(speech_folder_name):
+            if file.endswith(file_extension):
+                passed = check_feature_backend(speech_folder_name + f"/{file}") and passed
+        sys.exit(0 if passed else 1)
+
+    temporary_directory_path = os.path.join(speech_folder_name, temporary_directory)
+
+    if os.path.exists(temporary_directory_path) is False:
+        os.makedirs(temporary_directory_path)
+
+    yin_file = speech_folder_name + '/temp/YIN' + feature_file_extension
+    mfcc_file = speech_folder_name + '/temp/MFCC' + feature_file_extension
+    # metadata_file = speech_folder_name + '/temp/MetaData' + output_file_extension
+
+    rev_mfcc_file = speech_folder_name + '/temp/rev.MFCC' + feature_file_extension
+
+    merged_mfcc_file = speech_folder_name + '/temp/merged.MFCC' + feature_file_extension
+    new_mfcc_file = speech_folder_name + '/temp/new.MFCC' + feature_file_extension
+
     start = process_time()
     final_speaker_count, total_segments, total_voiced_segments, total_merged_segments = count_speaker(
-        speech_folder_name, file_extension, yin_file, mfcc_file, rev_mfcc_file, merged_mfcc_file)
+        speech_folder_name, file_extension, yin_file, mfcc_file, rev_mfcc_file, merged_mfcc_file, new_mfcc_file)
     end = process_time()
 
     # print()
@@ -539,6 +1836,7 @@ def main():
     print("Total number of segments after the merger of neighboring voiced segments:", total_merged_segments)
     print(final_speaker_count, "number of different speakers identified in all the audio clips of the input folder")
     print("Time elapsed during the computation:", end - start, "seconds")
+    report_decoders()
 
 
 # Using the special variable __name__